@@ -1,4 +1,5 @@
-import os, logging
+import os, logging, asyncio
+from contextlib import asynccontextmanager
 from typing import List
 from logging.handlers import RotatingFileHandler
 from starlette.exceptions import HTTPException as StarletteHTTPException
@@ -9,16 +10,37 @@ from app.modules.core.routers.user_router import router as user_router
 from app.modules.core.routers.file_router import router as file_router
 from app.modules.core.routers.params_router import router as params_router
 from app.modules.core.routers.root_router import router as root_router
+from app.modules.core.routers.metrics_router import router as metrics_router
 from app.error_handlers import validation_exception_handler, http_exception_handler, starlette_http_exception_handler
 from app.schemas import ValidationErrorSchema
 from app.common.response import StandardResponse
 from app.middlewares import middlewares
+from app.common.redis import get_redis, close_redis
+from app.common.db import async_engine, replica_engines, warm_up
+from app.modules.core.services.principal_cache import principal_cache
 from config import settings
 
 
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    get_redis()
+    for engine in [async_engine, *replica_engines]:
+        await warm_up(engine, settings.DB_POOL_MIN_SIZE)
+    invalidation_listener = None
+    if settings.PRINCIPAL_CACHE_ENABLED and principal_cache.use_redis:
+        invalidation_listener = asyncio.create_task(principal_cache.listen_for_invalidations())
+    yield
+    if invalidation_listener is not None:
+        invalidation_listener.cancel()
+    await close_redis()
+    for engine in [async_engine, *replica_engines]:
+        await engine.dispose()
+
+
 def create_app():
     # create app
     app = FastAPI(
+        lifespan=lifespan,
         exception_handlers={
             RequestValidationError: validation_exception_handler,
             HTTPException: http_exception_handler,
@@ -39,6 +61,7 @@ def create_app():
     app.include_router(web_auth_router, prefix='/web')
     app.include_router(user_router, prefix='/api/v1')
     app.include_router(params_router, prefix='/api/v1')
+    app.include_router(metrics_router, prefix='/api/v1')
     app.include_router(file_router)
 
     # configure logging
@@ -1,10 +1,11 @@
-from typing import Type, TypeVar, Generic, List, Any
+from typing import Optional, Type, TypeVar, Generic, List, Any, Dict, Tuple
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select
-from sqlalchemy.orm import joinedload
+from sqlalchemy import delete, func, insert, select, union_all, update
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.orm import joinedload, selectinload
 from sqlalchemy.sql import Select
-from app.common.paginator import Paginator
-from sqlalchemy.orm import joinedload
+from app.common.loader import forget, get_loader
+from app.common.paginator import Paginator, KeysetPaginator
 from sqlalchemy.inspection import inspect
 
 
@@ -31,6 +32,11 @@ class BaseRepository(Generic[T]):
         return results.all()
 
     async def get_first_by_field(self, field: str, value: Any, unique: bool = True, relationships_to_load: List[str] = None) -> T:
+        if unique and not relationships_to_load and value is not None:
+            # coalesced with concurrent lookups and memoized for the request (the
+            # loader de-duplicates rows, so only when `unique` was asked for)
+            return await get_loader(self.db, self.model, field).load(value)
+
         statement = select(self.model).where(getattr(self.model, field) == value)
         statement = self._apply_relationships_loading(statement, relationships_to_load)
         results = await self.db.execute(statement)
@@ -40,6 +46,55 @@ class BaseRepository(Generic[T]):
         fetched_result = fetched_results[0] if fetched_results else None
         return fetched_result[0] if fetched_result else None
 
+    async def get_by_ids(self, ids: List[Any], relationships_to_load: List[str] = None,
+                         load_options: Optional[list] = None) -> List[T]:
+        '''Entities by primary key in a single query, in the order of `ids`.
+        Ids that don't exist are left out.'''
+        ids = list(dict.fromkeys(ids))
+        if not ids:
+            return []
+        if not relationships_to_load and not load_options:
+            primary_key = inspect(self.model).primary_key[0].key
+            items = await get_loader(self.db, self.model, primary_key).load_many(ids)
+            return [item for item in items if item is not None]
+
+        primary_key = inspect(self.model).primary_key[0]
+        statement = select(self.model).where(primary_key.in_(ids))
+        statement = self._apply_relationships_loading(statement, relationships_to_load)
+        if load_options:
+            statement = statement.options(*load_options)
+        items = {inspect(item).identity[0]: item for item in (await self.db.scalars(statement)).unique()}
+        return [items[id] for id in ids if id in items]
+
+    async def suggest_by_prefix(self, prefix: str, expressions: list, label: Any, limit: int) -> list:
+        '''(id, name) of at most `limit` entities for which one of the normalized
+        `expressions` (see search_expression) starts with `prefix`, ordered by
+        it. Each expression is read as a range on its COLLATE "C" index and
+        stops after `limit` rows, however many entities match. No count.'''
+        primary_key = inspect(self.model).primary_key[0]
+        normalized_prefix = func.lower(func.immutable_unaccent(prefix))
+        queries = []
+        for expression in expressions:
+            expression = expression.collate('C')
+            queries.append(
+                select(primary_key.label('id'), label.label('name'), expression.label('sort_key'))
+                    .where(expression >= normalized_prefix,
+                           expression < normalized_prefix.op('||')(func.chr(0x10FFFF)))
+                    .order_by(expression)
+                    .limit(limit)
+            )
+        if len(queries) == 1:
+            return (await self.db.execute(queries[0])).all()
+
+        matches = union_all(*queries).subquery()
+        statement = (
+            select(matches.c.id, matches.c.name)
+                .group_by(matches.c.id, matches.c.name)
+                .order_by(func.min(matches.c.sort_key))
+                .limit(limit)
+        )
+        return (await self.db.execute(statement)).all()
+
     # NOTE: not used but could be useful in the future
     # async def get_by_fields(self, fields: List[Tuple[str, Any]], use_or: bool = False, unique: bool = True) -> List[T]:
     #     if not fields:
@@ -69,50 +124,141 @@ class BaseRepository(Generic[T]):
         return obj
 
     async def delete(self, obj: T) -> None:
+        forget(self.db, obj)
         await self.db.delete(obj)
 
-    async def paginate(self, query: Select, page: int, per_page: int) -> dict:
-        paginator = Paginator(self.db, query, page, per_page, self.model)
+    async def bulk_insert(self, rows: List[dict], returning: Optional[List[str]] = None) -> list:
+        '''Inserts `rows` without creating ORM objects. Returns the `returning`
+        columns of the inserted rows, in order, or an empty list.'''
+        if not rows:
+            return []
+        statement = insert(self.model.__table__)
+        if returning:
+            statement = statement.returning(*[self.model.__table__.c[column] for column in returning], sort_by_parameter_order=True)
+            return (await self.db.execute(statement, rows)).all()
+        await self.db.execute(statement, rows)
+        return []
+
+    async def bulk_update(self, rows: List[dict]) -> None:
+        '''Updates rows by primary key; every dict must contain the primary key
+        and the columns to set. Objects already in the session are updated too.'''
+        if rows:
+            await self.db.execute(update(self.model), rows)
+
+    async def bulk_delete(self, *criteria) -> int:
+        '''Deletes every row matching `criteria` in one statement and returns
+        how many were deleted.'''
+        result = await self.db.execute(delete(self.model).where(*criteria))
+        return result.rowcount
+
+    async def upsert(self, rows: List[dict], index_elements: List[str], update_fields: Optional[List[str]] = None,
+                     returning: Optional[List[str]] = None) -> list:
+        '''INSERT ... ON CONFLICT (index_elements): updates `update_fields` from
+        the conflicting row, or does nothing when there are none to update.
+        `returning` columns come back for the rows inserted or updated only.'''
+        if not rows:
+            return []
+        table = self.model.__table__
+        statement = postgresql.insert(table)
+        if update_fields:
+            set_ = {field: statement.excluded[field] for field in update_fields}
+            if 'updated_at' in table.c and 'updated_at' not in set_:
+                # the column's onupdate doesn't apply to ON CONFLICT; naive UTC like its default
+                set_['updated_at'] = func.timezone('utc', func.now())
+            statement = statement.on_conflict_do_update(index_elements=index_elements, set_=set_)
+        else:
+            statement = statement.on_conflict_do_nothing(index_elements=index_elements)
+        if returning:
+            statement = statement.returning(*[table.c[column] for column in returning])
+            return (await self.db.execute(statement, rows)).all()
+        await self.db.execute(statement, rows)
+        return []
+
+    async def paginate(self, query: Select, page: int, per_page: int, keyset: bool = False, cursor: Optional[str] = None,
+                       count_strategy: str = 'exact', load_options: Optional[list] = None,
+                       sort: Optional[List[Tuple[Any, bool]]] = None) -> dict:
+        if keyset:
+            paginator = KeysetPaginator(self.db, query, cursor, per_page, self.model, count_strategy, load_options, sort)
+        else:
+            paginator = Paginator(self.db, query, page, per_page, self.model, count_strategy, load_options, sort)
         return await paginator.get_response()
 
     async def ensure_relationships_loaded(self, instance: T, relationships: List[str]):
-        for relationship in relationships:
-            nested_relationships = relationship.split('.')
-            current_instance = instance
-            for rel_name in nested_relationships:
-                if not rel_name not in inspect(instance).unloaded:
-                    await self.db.refresh(
-                        current_instance,
-                        [rel_name],
-                        with_for_update=False
-                    )
-                current_instance = getattr(current_instance, rel_name)
+        '''Loads the relationship paths that are not loaded yet on `instance`.
+        Nothing is queried for what is already loaded; the rest is loaded with a
+        single query per level of nesting.'''
+        await self._load_unloaded(type(instance), [instance], [path.split('.') for path in relationships])
+
+    async def _load_unloaded(self, model: type, instances: list, paths: List[List[str]]):
+        instances = [instance for instance in instances if inspect(instance).identity is not None]
+        if not instances or not paths:
+            return
+
+        unloaded = {parts[0] for parts in paths for instance in instances if parts[0] in inspect(instance).unloaded}
+        if unloaded:
+            # re-selecting the instances populates their unloaded attributes (and
+            # the rest of the path below them) without touching what is loaded
+            primary_key = inspect(model).primary_key[0]
+            ids = [inspect(instance).identity[0] for instance in instances]
+            load_options = get_load_options(model, tuple('.'.join(parts) for parts in paths if parts[0] in unloaded))
+            await self.db.execute(select(model).where(primary_key.in_(ids)).options(*load_options))
+
+        # what was already loaded may still have unloaded relationships below it
+        nested_paths = {}
+        for parts in paths:
+            if len(parts) > 1:
+                nested_paths.setdefault(parts[0], []).append(parts[1:])
+        for rel_name, rest in nested_paths.items():
+            relationship = inspect(model).relationships[rel_name]
+            related = []
+            for instance in instances:
+                value = getattr(instance, rel_name)
+                if relationship.uselist:
+                    related.extend(value)
+                elif value is not None:
+                    related.append(value)
+            await self._load_unloaded(relationship.entity.class_, related, rest)
 
     def _apply_relationships_loading(self, statement: Select, relationships_to_load: List[str]):
-        if relationships_to_load:
-            for relationship_path in relationships_to_load:
-                path_parts = relationship_path.split('.')
-                load_option = None
-                model = self.model
+        load_options = self._get_relationships_load_options(relationships_to_load)
+        if load_options:
+            statement = statement.options(*load_options)
+        return statement
 
-                for i, part in enumerate(path_parts):
-                    if not hasattr(model, part):
-                        raise AttributeError(f"Invalid relationship path: '{relationship_path}' at '{part}'")
+    def _get_relationships_load_options(self, relationships_to_load: List[str]) -> list:
+        if not relationships_to_load:
+            return []
+        return get_load_options(self.model, tuple(relationships_to_load))
 
-                    prop = getattr(model, part)
-                    mapper = inspect(model).relationships.get(part)
 
-                    if not mapper:
-                        raise AttributeError(f"No relationship found for '{part}' in '{model.__name__}'")
+_load_options_cache: Dict[Tuple[type, Tuple[str, ...]], list] = {}
 
-                    if i == 0:
-                        load_option = joinedload(prop)
-                    else:
-                        load_option = load_option.joinedload(prop)
 
-                    model = mapper.entity.class_
+def get_load_options(model: type, relationship_paths: Tuple[str, ...]) -> list:
+    '''Loader options for dotted relationship paths starting at `model`:
+    many-to-one relationships are joined into the same query and collections
+    are loaded with one extra SELECT ... IN query each, so rows are never
+    multiplied by joined collections. Options are cached per (model, paths).'''
+    key = (model, relationship_paths)
+    load_options = _load_options_cache.get(key)
+    if load_options is None:
+        load_options = [_build_load_option(model, path) for path in relationship_paths]
+        _load_options_cache[key] = load_options
+    return load_options
 
 
-                if load_option:
-                    statement = statement.options(load_option)
-        return statement
+def _build_load_option(model: type, relationship_path: str):
+    load_option = None
+    for part in relationship_path.split('.'):
+        if not hasattr(model, part):
+            raise AttributeError(f"Invalid relationship path: '{relationship_path}' at '{part}'")
+
+        relationship = inspect(model).relationships.get(part)
+        if not relationship:
+            raise AttributeError(f"No relationship found for '{part}' in '{model.__name__}'")
+
+        loader = selectinload if relationship.uselist else joinedload
+        prop = getattr(model, part)
+        load_option = loader(prop) if load_option is None else getattr(load_option, loader.__name__)(prop)
+        model = relationship.entity.class_
+    return load_option
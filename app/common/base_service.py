@@ -18,5 +18,8 @@ class BaseService:
     async def get_first_by_field(self, field: Column, value: Any,  unique=True, relationships_to_load: List[str] = None) -> T:
         return await self.repository.get_first_by_field(field, value, unique, relationships_to_load)
 
+    async def get_by_ids(self, ids: List[Any], relationships_to_load: List[str] = None) -> List[T]:
+        return await self.repository.get_by_ids(ids, relationships_to_load)
+
     async def delete(self, obj: T) -> None:
         return await self.repository.delete(obj)
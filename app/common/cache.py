@@ -0,0 +1,134 @@
+import asyncio
+import logging
+import time
+from collections import OrderedDict
+from typing import Any, Generic, Optional, Type, TypeVar
+from pydantic import BaseModel
+from redis.exceptions import RedisError
+from app.common.metrics import metrics
+from app.common.redis import execute, get_redis
+
+
+S = TypeVar('S', bound=BaseModel)
+
+
+class TTLCache:
+    '''In-process LRU cache whose entries also expire after `ttl` seconds.'''
+
+    def __init__(self, max_size: int, ttl: int):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.entries: OrderedDict = OrderedDict()
+
+    def get(self, key: Any) -> Optional[Any]:
+        entry = self.entries.get(key)
+        if entry is None:
+            return None
+        expires_at, value = entry
+        if expires_at < time.monotonic():
+            del self.entries[key]
+            return None
+        self.entries.move_to_end(key)
+        return value
+
+    def set(self, key: Any, value: Any) -> None:
+        self.entries[key] = (time.monotonic() + self.ttl, value)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+
+    def delete(self, key: Any) -> None:
+        self.entries.pop(key, None)
+
+    def clear(self) -> None:
+        self.entries.clear()
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+
+class TieredCache(Generic[S]):
+    '''A local TTLCache in front of an optional shared Redis cache. Values are
+    pydantic schemas so they can be stored in Redis as JSON.
+
+    Hits and misses are published as `cache.<namespace>.*` counters.
+
+    With Redis, deletes are also published on the `cache:<namespace>:invalidations`
+    channel so every worker running `listen_for_invalidations` drops its local
+    copy. Without Redis, other workers' local copies lag for up to `local_ttl`.'''
+
+    def __init__(self, namespace: str, schema: Type[S], max_size: int, local_ttl: int,
+                 redis_ttl: int, use_redis: bool = False):
+        self.namespace = namespace
+        self.schema = schema
+        self.local = TTLCache(max_size, local_ttl)
+        self.redis_ttl = redis_ttl
+        self.use_redis = use_redis
+
+    def _redis_key(self, key: Any) -> str:
+        return f"cache:{self.namespace}:{key}"
+
+    @property
+    def _channel(self) -> str:
+        return f"cache:{self.namespace}:invalidations"
+
+    def _count(self, event: str) -> None:
+        metrics.increment(f"cache.{self.namespace}.{event}")
+
+    async def get(self, key: Any) -> Optional[S]:
+        value = self.local.get(str(key))
+        if value is not None:
+            self._count('local_hits')
+            return value
+
+        if self.use_redis:
+            try:
+                raw = await execute(lambda redis: redis.get(self._redis_key(key)))
+            except RedisError as e:
+                logging.warning(f"Cache '{self.namespace}' read error: {e}")
+                raw = None
+            if raw is not None:
+                self._count('redis_hits')
+                value = self.schema.model_validate_json(raw)
+                self.local.set(str(key), value)
+                return value
+
+        self._count('misses')
+        return None
+
+    async def set(self, key: Any, value: S) -> None:
+        self.local.set(str(key), value)
+        metrics.set_gauge(f"cache.{self.namespace}.size", len(self.local))
+        if self.use_redis:
+            try:
+                await execute(lambda redis: redis.set(self._redis_key(key), value.model_dump_json(), ex=self.redis_ttl))
+            except RedisError as e:
+                logging.warning(f"Cache '{self.namespace}' write error: {e}")
+
+    async def delete(self, key: Any) -> None:
+        self.local.delete(str(key))
+        self._count('invalidations')
+        if self.use_redis:
+            try:
+                await execute(lambda redis: redis.delete(self._redis_key(key)))
+                await execute(lambda redis: redis.publish(self._channel, str(key)))
+            except RedisError as e:
+                logging.warning(f"Cache '{self.namespace}' delete error: {e}")
+
+    async def listen_for_invalidations(self, retry_delay: float = 1.0) -> None:
+        '''Drops local entries deleted by other workers; runs until cancelled.
+        The local tier is cleared whenever the subscription is (re)established,
+        since invalidations published while it was down are lost.'''
+        while True:
+            try:
+                async with get_redis().pubsub() as pubsub:
+                    await pubsub.subscribe(self._channel)
+                    self.local.clear()
+                    while True:
+                        message = await pubsub.get_message(ignore_subscribe_messages=True, timeout=1.0)
+                        if message is not None:
+                            self.local.delete(message['data'].decode())
+            except RedisError as e:
+                logging.warning(f"Cache '{self.namespace}' invalidation listener error: {e}")
+                self.local.clear()
+                await asyncio.sleep(retry_delay)
@@ -0,0 +1,54 @@
+import time
+from app.common.metrics import metrics
+
+
+class CircuitBreaker:
+    '''Opens after `failure_threshold` consecutive failures. While open, calls are
+    refused without touching the backing service; after `reset_timeout` seconds a
+    single trial call is let through (half open) and its outcome decides whether
+    the breaker closes again. Without an outcome another trial is let through
+    after a further `reset_timeout` seconds.'''
+
+    CLOSED = 0
+    OPEN = 1
+    HALF_OPEN = 2
+
+    def __init__(self, name: str, failure_threshold: int, reset_timeout: float):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = 0.0
+        self.state = self.CLOSED
+        self._publish()
+
+    def _publish(self) -> None:
+        metrics.set_gauge(f"circuit_breaker.{self.name}.state", self.state)
+
+    def _set_state(self, state: int) -> None:
+        if state != self.state:
+            self.state = state
+            metrics.increment(f"circuit_breaker.{self.name}.transitions")
+            self._publish()
+
+    def allow(self) -> bool:
+        if self.state == self.CLOSED:
+            return True
+        if time.monotonic() - self.opened_at >= self.reset_timeout:
+            # also when half open: a trial whose outcome was never recorded (e.g. it
+            # was cancelled) must not keep the breaker from ever closing again
+            self.opened_at = time.monotonic()
+            self._set_state(self.HALF_OPEN)
+            return True
+        return False
+
+    def record_success(self) -> None:
+        self.failures = 0
+        self._set_state(self.CLOSED)
+
+    def record_failure(self) -> None:
+        self.failures += 1
+        metrics.increment(f"circuit_breaker.{self.name}.failures")
+        if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+            self.opened_at = time.monotonic()
+            self._set_state(self.OPEN)
@@ -1,14 +1,134 @@
-from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
-from sqlalchemy.orm import declarative_base
+import asyncio
+import random
+import time
+import uuid
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Iterator, List
+from sqlalchemy import event
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import AsyncEngine, create_async_engine, AsyncSession
+from sqlalchemy.orm import Session, declarative_base
+from sqlalchemy.pool import AsyncAdaptedQueuePool, NullPool
+from app.common.metrics import metrics
 from config import settings, current_env
 
 sqlalchemy_database_url = settings.sqlalchemy_test_database_url if current_env == "testing" else settings.sqlalchemy_database_url
 echo = True if current_env == "development" else False
 
-async_engine = create_async_engine(sqlalchemy_database_url, echo=echo)
+
+class InstrumentedQueuePool(AsyncAdaptedQueuePool):
+    '''Publishes how long checkouts wait for a connection and how many are in use.'''
+
+    def _do_get(self):
+        started_at = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            metrics.observe("db.pool.checkout_wait_seconds", time.perf_counter() - started_at)
+            self.publish_usage()
+
+    def publish_usage(self) -> None:
+        metrics.set_gauge("db.pool.in_use", self.checkedout())
+        metrics.set_gauge("db.pool.overflow", max(self.overflow(), 0))
+        metrics.set_gauge("db.pool.idle", self.checkedin())
+
+
+def create_engine(url: str, pgbouncer: bool = False) -> AsyncEngine:
+    '''With `pgbouncer`, the engine is safe behind a transaction pooler: a server
+    connection may change between transactions, so prepared statements are given
+    unique names and never cached, and pooling is left to the bouncer.'''
+    if pgbouncer:
+        engine = create_async_engine(
+            make_url(url).update_query_dict({"prepared_statement_cache_size": "0"}),
+            echo=echo,
+            poolclass=NullPool,
+            connect_args={
+                "statement_cache_size": 0,
+                "prepared_statement_name_func": lambda: f"__asyncpg_{uuid.uuid4()}__",
+            },
+        )
+        return engine
+
+    url = make_url(url).update_query_dict({
+        "prepared_statement_cache_size": str(settings.DB_PREPARED_STATEMENT_CACHE_SIZE),
+    })
+    engine = create_async_engine(
+        url,
+        echo=echo,
+        poolclass=InstrumentedQueuePool,
+        pool_size=settings.DB_POOL_SIZE,
+        max_overflow=settings.DB_MAX_OVERFLOW,
+        pool_timeout=settings.DB_POOL_TIMEOUT,
+        pool_recycle=settings.DB_POOL_RECYCLE,
+        pool_pre_ping=settings.DB_POOL_PRE_PING,
+    )
+
+    @event.listens_for(engine.sync_engine, "checkin")
+    def on_checkin(dbapi_connection, connection_record):
+        engine.sync_engine.pool.publish_usage()
+
+    return engine
+
+
+async def warm_up(engine: AsyncEngine, min_size: int) -> None:
+    '''Opens `min_size` connections and returns them to the pool, so the first
+    requests after a deploy don't pay for connection setup.'''
+    if min_size <= 0 or isinstance(engine.pool, NullPool):
+        return
+    connections = await asyncio.gather(*[engine.connect() for _ in range(min_size)])
+    for connection in connections:
+        await connection.close()
+
+
+async_engine = create_engine(sqlalchemy_database_url, pgbouncer=settings.DB_PGBOUNCER_MODE)
+replica_engines: List[AsyncEngine] = [
+    create_engine(url, pgbouncer=settings.DB_PGBOUNCER_MODE)
+    for url in ([] if current_env == "testing" else settings.sqlalchemy_replica_database_urls)
+]
 Base = declarative_base()
 
+# set per request by ReplicaRoutingMiddleware
+use_replica: ContextVar[bool] = ContextVar('use_replica', default=False)
+
+
+class RoutingSession(Session):
+    '''Sends reads to a replica when the session was opened for a read-only
+    request, and everything else to the primary. The replica is picked once per
+    session, so all of its reads see the same snapshot lag. Once a session has
+    flushed, it stays on the primary so it reads its own writes.'''
+
+    def get_bind(self, mapper=None, clause=None, **kwargs):
+        if replica_engines and self.info.get("use_replica") and not self._flushing and not self.info.get("wrote"):
+            replica = self.info.get("replica")
+            if replica is None:
+                replica = self.info["replica"] = random.choice(replica_engines)
+            return replica.sync_engine
+        return async_engine.sync_engine
+
+
+@event.listens_for(RoutingSession, "before_flush")
+def on_before_flush(session, flush_context, instances):
+    session.info["wrote"] = True
+
+
+@contextmanager
+def use_primary(session: AsyncSession) -> Iterator[None]:
+    '''Reads made inside go to the primary even on a read-only request, for
+    data a lagging replica must not serve (e.g. what authorizes the request).'''
+    previous = session.info.get("use_replica")
+    session.info["use_replica"] = False
+    try:
+        yield
+    finally:
+        session.info["use_replica"] = previous
+
 
 async def get_db():
-    async with AsyncSession(async_engine) as session:
+    if not replica_engines:
+        async with AsyncSession(async_engine) as session:
+            yield session
+        return
+
+    async with AsyncSession(sync_session_class=RoutingSession, info={"use_replica": use_replica.get()}) as session:
         yield session
@@ -1,9 +1,10 @@
-from typing import Any, Callable, Dict, List, Tuple
-from fastapi import Query
+from typing import Any, Callable, Dict, List, Optional, Tuple
+from fastapi import HTTPException, Query, status
 from pydantic import BaseModel as BaseSchema
-from sqlalchemy import AliasedReturnsRows, Select, and_, func
+from sqlalchemy import DDL, AliasedReturnsRows, Select, and_, event, func, literal_column
 from sqlalchemy.orm import aliased
 from app.common.base_model import BaseModel
+from app.common.db import Base
 
 
 class FilterConfig:
@@ -14,47 +15,131 @@ class FilterConfig:
         self.comparison = comparison
 
 
+class CompiledFilter:
+    '''One filter with everything resolved: the joins it needs, as
+    (path, target, on clause), and `build(value)` returning its condition.'''
+
+    def __init__(self, field_name: str, joins: List[Tuple[str, Any, Any]], build: Callable[[Any], Any]):
+        self.field_name = field_name
+        self.joins = joins
+        self.build = build
+
+
+class FilterPlan:
+    def __init__(self, model: BaseModel, filters: List[CompiledFilter]):
+        self.model = model
+        self.filters = filters
+
+
+_filter_plans: Dict[type, FilterPlan] = {}
+
+
 class BaseFiltering(BaseSchema):
+    sort: Optional[str] = None
+
     def apply_filters(self) -> Query:
-        model, filters_config = self.filters_config()
-        query = Select(model)
+        plan = self.get_filter_plan()
+        query = Select(plan.model)
         conditions = []
+        joined = set()
 
-        for field_name, filter_config in filters_config.items():
-            value = getattr(self, field_name, None)
+        for compiled_filter in plan.filters:
+            value = getattr(self, compiled_filter.field_name, None)
             if value is not None:
-                if len(filter_config.model_fields) > 1:
-                    # Handle multiple fields (e.g., concatenating fields)
-                    fields = []
-                    for model_field in filter_config.model_fields:
-                        field = self.resolve_field(model, model_field)
-                        fields.append(field)
-                    condition = filter_config.comparison(fields, value)
-                    conditions.append(condition)
-                else:
-                    # Handle single field
-                    for model_field in filter_config.model_fields:
-                        parts = model_field.split('.')
-                        current_model = model
-                        for i, part in enumerate(parts[:-1]):
-                            relationship_attr = getattr(current_model, part)
-                            if hasattr(relationship_attr, 'property') and hasattr(relationship_attr.property, 'mapper'):
-                                related_model = aliased(relationship_attr.property.mapper.class_)
-                                # Explicit ON clause for join
-                                query = query.join(related_model, relationship_attr)
-                                current_model = related_model
-                            else:
-                                raise AttributeError(f"Relationship '{part}' not found in {current_model.__name__}")
-
-                        final_field = getattr(current_model, parts[-1], None)
-                        condition = filter_config.comparison([final_field], value)
-                        conditions.append(condition)
+                for path, target, on_clause in compiled_filter.joins:
+                    # many-to-one paths are joined once, whatever filters use them
+                    if path not in joined:
+                        query = query.join(target, on_clause)
+                        joined.add(path)
+                conditions.append(compiled_filter.build(value))
 
         if conditions:
             query = query.where(and_(*conditions))
 
         return query
 
+    def get_filter_plan(self) -> FilterPlan:
+        '''filters_config() compiled once per subclass, on first use: paths are
+        resolved and aliases created up front, so requests only bind values.
+        Aliases being the same objects every time also keeps the statement's
+        cache key stable, so SQLAlchemy reuses the compiled SQL.'''
+        plan = _filter_plans.get(type(self))
+        if plan is None:
+            plan = _filter_plans[type(self)] = self._compile_filters()
+        return plan
+
+    def _compile_filters(self) -> FilterPlan:
+        model, filters_config = self.filters_config()
+        # one alias per many-to-one path, shared by every filter on that path
+        aliases: Dict[str, Any] = {}
+        compiled_filters = []
+
+        for field_name, filter_config in filters_config.items():
+            comparison = filter_config.comparison
+            if len(filter_config.model_fields) > 1:
+                # Handle multiple fields (e.g., concatenating fields)
+                fields = [self.resolve_field(model, model_field) for model_field in filter_config.model_fields]
+                compiled_filters.append(CompiledFilter(field_name, [], self._bind(comparison, fields)))
+                continue
+
+            # Handle single field
+            for model_field in filter_config.model_fields:
+                parts = model_field.split('.')
+                current_model = model
+                joins = []
+                build = None
+                for i, part in enumerate(parts[:-1]):
+                    relationship_attr = self._get_relationship(current_model, part)
+                    if relationship_attr.property.uselist:
+                        # to-many: a correlated EXISTS keeps one row per entity
+                        # instead of one per related row
+                        build = self._compile_exists(current_model, parts[i:], comparison)
+                        break
+
+                    path = '.'.join(parts[:i + 1])
+                    if path not in aliases:
+                        aliases[path] = aliased(relationship_attr.property.mapper.class_)
+                    # Explicit ON clause for join
+                    joins.append((path, aliases[path], relationship_attr))
+                    current_model = aliases[path]
+
+                if build is None:
+                    build = self._bind(comparison, [getattr(current_model, parts[-1], None)])
+                compiled_filters.append(CompiledFilter(field_name, joins, build))
+
+        return FilterPlan(model, compiled_filters)
+
+    @staticmethod
+    def _bind(comparison: Callable, fields: List[Any]) -> Callable[[Any], Any]:
+        return lambda value: comparison(fields, value)
+
+    def _compile_exists(self, model, parts: List[str], comparison: Callable) -> Callable[[Any], Any]:
+        '''`parts` relative to `model` as nested EXISTS subqueries: any() for
+        collections and has() for many-to-one relationships below them.'''
+        relationships = []
+        for part in parts[:-1]:
+            relationship_attr = self._get_relationship(model, part)
+            relationships.append(relationship_attr)
+            model = relationship_attr.property.mapper.class_
+        field = getattr(model, parts[-1])
+
+        def build(value):
+            condition = comparison([field], value)
+            for relationship_attr in reversed(relationships):
+                if relationship_attr.property.uselist:
+                    condition = relationship_attr.any(condition)
+                else:
+                    condition = relationship_attr.has(condition)
+            return condition
+        return build
+
+    @staticmethod
+    def _get_relationship(model, part: str):
+        relationship_attr = getattr(model, part)
+        if not (hasattr(relationship_attr, 'property') and hasattr(relationship_attr.property, 'mapper')):
+            raise AttributeError(f"Relationship '{part}' not found in {model.__name__}")
+        return relationship_attr
+
     def resolve_field(self, model, field_path: str):
         field_parts = field_path.split('.')
         current_model = model
@@ -76,6 +161,27 @@ class BaseFiltering(BaseSchema):
     def filters_config(self) -> Tuple[BaseModel, Dict[str, FilterConfig]]:
         raise NotImplementedError  # Override in subclass
 
+    def sortable_fields(self) -> Dict[str, str]:
+        '''`sort` values accepted, mapped to model columns. Each one should be
+        backed by a (column, id) index, id being the tiebreaker the paginators
+        always add. Nothing is sortable unless a subclass says so.'''
+        return {}
+
+    def get_sort(self) -> Optional[List[Tuple[Any, bool]]]:
+        '''`sort=field` (ascending) or `sort=-field` (descending) as the
+        (column, descending) pairs the paginators take.'''
+        if not self.sort:
+            return None
+        descending = self.sort.startswith('-')
+        field = self.sort.lstrip('-')
+        sortable_fields = self.sortable_fields()
+        if field not in sortable_fields:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail=f"Can't sort by '{field}', sortable fields: {', '.join(sortable_fields)}"
+            )
+        return [(getattr(self.get_filter_plan().model, sortable_fields[field]), descending)]
+
 
 # Comparison functions
 
@@ -109,9 +215,54 @@ def less_than_or_equal(fields, input_value):
     return fields[0] <= input_value
 
 
+def search_expression(*fields):
+    '''lower(immutable_unaccent(...)) of the fields joined with spaces. This is
+    the expression the trigram indexes are built on (see the models and the
+    "search indexes" migration), so it must not change without them.
+    concat_ws can't be used in an index, hence the coalesce chain.'''
+    if len(fields) == 1:
+        text = fields[0]
+    else:
+        text = func.coalesce(fields[0], literal_column("''"))
+        for field in fields[1:]:
+            text = text.op('||')(literal_column("' '")).op('||')(func.coalesce(field, literal_column("''")))
+    return func.lower(func.immutable_unaccent(text))
+
+
 def enhanced_ilike(fields, input_value):
     '''This function concatenates all fields, like "name" and "surname" with a space in between,
-    then it applies both unaccent and lower functions and finally applies an ilike comparison.'''
-    concatenated_fields = func.lower(func.unaccent(func.concat_ws(' ', *fields)))
-    cleaned_input = func.lower(func.unaccent(f'%{input_value}%'))
-    return concatenated_fields.ilike(cleaned_input)
+    then it applies both unaccent and lower functions and finally applies an ilike comparison.
+    Both sides are already lowercased, so a plain LIKE does, and it can use the trigram indexes.'''
+    cleaned_input = func.lower(func.immutable_unaccent(f'%{input_value}%'))
+    return search_expression(*fields).like(cleaned_input)
+
+
+def normalized_like(fields, input_value):
+    '''enhanced_ilike for columns that already hold search_expression values,
+    like the ones of a search read model.'''
+    if len(fields) > 1:
+        raise ValueError("Normalized like comparison function expects only one field.")
+    return fields[0].like(func.lower(func.immutable_unaccent(f'%{input_value}%')))
+
+
+def array_contains(fields, input_value):
+    if len(fields) > 1:
+        raise ValueError("Array contains comparison function expects only one field.")
+    return fields[0].contains([input_value])
+
+
+# immutable (unlike unaccent itself, which depends on search_path) so it can be
+# used in index expressions. Also created by the "search indexes" migration.
+SEARCH_DDL = [
+    "CREATE EXTENSION IF NOT EXISTS unaccent",
+    "CREATE EXTENSION IF NOT EXISTS pg_trgm",
+    "CREATE OR REPLACE FUNCTION immutable_unaccent(text) RETURNS text "
+    "LANGUAGE sql IMMUTABLE PARALLEL SAFE STRICT "
+    "AS $$ SELECT public.unaccent('public.unaccent'::regdictionary, $1) $$",
+]
+for statement in SEARCH_DDL:
+    event.listen(Base.metadata, 'before_create', DDL(statement).execute_if(dialect='postgresql'))
+event.listen(
+    Base.metadata, 'after_drop',
+    DDL("DROP FUNCTION IF EXISTS immutable_unaccent(text)").execute_if(dialect='postgresql')
+)
@@ -0,0 +1,99 @@
+import asyncio
+from typing import Any, Dict, List, Optional, Set
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.inspection import inspect
+
+
+class BatchLoader:
+    '''DataLoader-style lookups of one model by one field. Lookups made in the
+    same event loop iteration (e.g. under asyncio.gather) are coalesced into a
+    single `IN` query, and what was found is memoized for the lifetime of the
+    session, which is one request. Memoized entities that were expired (by a
+    commit), deleted or whose field changed are fetched again. The queries of
+    all the loaders bound to a session run one at a time.'''
+
+    def __init__(self, db: AsyncSession, model: type, field: str):
+        self.db = db
+        self.model = model
+        self.field = field
+        self.found: Dict[Any, Any] = {}
+        self.pending: Dict[Any, asyncio.Future] = {}
+        # running dispatches; the event loop only keeps weak references to tasks
+        self.dispatches: Set[asyncio.Task] = set()
+
+    def _get_found(self, value: Any) -> Optional[Any]:
+        item = self.found.get(value)
+        if item is None:
+            return None
+        state = inspect(item)
+        if not state.persistent or state.expired_attributes or state.dict.get(self.field) != value:
+            del self.found[value]
+            return None
+        return item
+
+    async def load(self, value: Any) -> Optional[Any]:
+        item = self._get_found(value)
+        if item is not None:
+            return item
+
+        future = self.pending.get(value)
+        if future is None:
+            loop = asyncio.get_running_loop()
+            future = loop.create_future()
+            self.pending[value] = future
+            if len(self.pending) == 1:
+                # runs after every lookup already scheduled in this iteration
+                loop.call_soon(self._start_dispatch)
+        return await future
+
+    async def load_many(self, values: List[Any]) -> List[Optional[Any]]:
+        return list(await asyncio.gather(*[self.load(value) for value in values]))
+
+    def forget(self, item: Any) -> None:
+        self.found = {value: found for value, found in self.found.items() if found is not item}
+
+    def _start_dispatch(self) -> None:
+        task = asyncio.ensure_future(self._dispatch())
+        self.dispatches.add(task)
+        task.add_done_callback(self.dispatches.discard)
+
+    async def _dispatch(self) -> None:
+        pending, self.pending = self.pending, {}
+        try:
+            # the session can't run two statements at once: dispatches of every
+            # loader bound to it, and later waves of this one, take turns
+            async with self.db.info.setdefault('loader_lock', asyncio.Lock()):
+                column = getattr(self.model, self.field)
+                items = (await self.db.scalars(select(self.model).where(column.in_(list(pending))))).unique()
+                for item in items:
+                    self.found.setdefault(getattr(item, self.field), item)
+        except Exception as e:
+            for future in pending.values():
+                if not future.done():
+                    future.set_exception(e)
+            return
+        except BaseException:
+            # e.g. the dispatch itself was cancelled: nobody may be left waiting forever
+            for future in pending.values():
+                future.cancel()
+            raise
+
+        for value, future in pending.items():
+            if not future.done():
+                future.set_result(self.found.get(value))
+
+
+def get_loader(db: AsyncSession, model: type, field: str) -> BatchLoader:
+    '''The loader for (model, field) bound to `db`, created on first use.'''
+    loaders = db.info.setdefault('loaders', {})
+    loader = loaders.get((model, field))
+    if loader is None:
+        loader = loaders[(model, field)] = BatchLoader(db, model, field)
+    return loader
+
+
+def forget(db: AsyncSession, item: Any) -> None:
+    for (model, _), loader in db.info.get('loaders', {}).items():
+        if isinstance(item, model):
+            loader.forget(item)
@@ -0,0 +1,34 @@
+from collections import defaultdict
+from typing import Dict
+
+
+class Metrics:
+    '''Minimal in-process metrics registry. Values are per worker; scrape every
+    worker (or aggregate in the log pipeline) to get a global view.'''
+
+    def __init__(self):
+        self.counters: Dict[str, int] = defaultdict(int)
+        self.gauges: Dict[str, float] = {}
+        self.timings: Dict[str, Dict[str, float]] = {}
+
+    def increment(self, name: str, value: int = 1) -> None:
+        self.counters[name] += value
+
+    def set_gauge(self, name: str, value: float) -> None:
+        self.gauges[name] = value
+
+    def observe(self, name: str, value: float) -> None:
+        timing = self.timings.setdefault(name, {'count': 0, 'sum': 0.0, 'max': 0.0})
+        timing['count'] += 1
+        timing['sum'] += value
+        timing['max'] = max(timing['max'], value)
+
+    def snapshot(self) -> dict:
+        return {
+            'counters': dict(self.counters),
+            'gauges': dict(self.gauges),
+            'timings': {name: dict(timing) for name, timing in self.timings.items()},
+        }
+
+
+metrics = Metrics()
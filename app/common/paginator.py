@@ -1,64 +1,256 @@
+import hashlib
+import json
+import logging
+from datetime import datetime
 from pydantic import AnyHttpUrl, Field, BaseModel
-from typing import Optional, Generic, Type, TypeVar, List
-from sqlalchemy import Select, distinct, func, select
+from typing import Any, Optional, Generic, Type, TypeVar, List, Tuple
+from fastapi import HTTPException, status
+from itsdangerous import BadSignature
+from redis.exceptions import RedisError
+from sqlalchemy import DateTime, Select, distinct, func, select, text, tuple_
+from sqlalchemy.dialects import postgresql
 from sqlalchemy.ext.asyncio.session import AsyncSession
+from app.common.redis import execute
+from app.common.security import encrypt, decrypt
 from app.middlewares import request_object
+from config import settings
 
 
 M = TypeVar('M')
 
 
 class Paginator:
-    def __init__(self, db: AsyncSession, query: Select, page: int, per_page: int, primary_entity: Type[BaseModel]):
+    '''Offset pagination. How the total count is obtained is chosen per request:
+
+    - exact: count(distinct pk) over the filtered query.
+    - cached: the exact count, cached in Redis for PAGINATION_COUNT_CACHE_TTL
+      seconds under a key derived from the compiled query and its parameters.
+    - estimated: pg_class.reltuples for unfiltered queries, the planner's row
+      estimate (EXPLAIN) otherwise.
+    - none: no count at all; `next_page` is still exact because one extra row
+      is always fetched to know whether there is a next page.'''
+
+    COUNT_STRATEGIES = ('exact', 'cached', 'estimated', 'none')
+
+    def __init__(self, db: AsyncSession, query: Select, page: int, per_page: int, primary_entity: Type[BaseModel],
+                 count_strategy: str = 'exact', load_options: Optional[List[Any]] = None,
+                 sort: Optional[List[Tuple[Any, bool]]] = None):
+        if count_strategy not in self.COUNT_STRATEGIES:
+            raise ValueError(f"Unknown count strategy '{count_strategy}'")
         self.db = db
         self.query = query
         self.page = page
         self.per_page = per_page
-        self.limit = per_page * page
+        self.limit = per_page
         self.offset = (page - 1) * per_page
         self.request = request_object.get()
-        self.number_of_pages = 0
+        self.number_of_pages = None
+        self.has_more = False
         self.next_page = ''
         self.previous_page = ''
         self.primary_entity = primary_entity
+        self.primary_key = primary_entity.__table__.primary_key.columns.values()[0]
+        self.count_strategy = count_strategy
+        self.load_options = load_options or []
+        # (column, descending) pairs, always ending with the primary key so the
+        # order is total and stable across pages
+        self.sort = [item for item in (sort or []) if item[0].key != self.primary_key.key]
+        self.sort.append((self.primary_key, self.sort[0][1] if self.sort else False))
 
     def _get_next_page(self) -> Optional[str]:
-        if self.page >= self.number_of_pages:
+        if not self.has_more:
             return
         url = self.request.url.include_query_params(page=self.page + 1)
         return str(url)
 
     def _get_previous_page(self) -> Optional[str]:
-        if self.page == 1 or self.page > self.number_of_pages + 1:
+        if self.page == 1 or (self.number_of_pages is not None and self.page > self.number_of_pages + 1):
             return
         url = self.request.url.include_query_params(page=self.page - 1)
         return str(url)
 
     async def get_response(self) -> dict:
+        count = await self._get_total_count()
+        items = await self._get_items()
         return {
-            'count': await self._get_total_count(),
+            'count': count,
             'number_of_pages': self.number_of_pages,
             'next_page': self._get_next_page(),
             'previous_page': self._get_previous_page(),
-            'items': [todo for todo in (await self.db.scalars(self.query.limit(self.limit).offset(self.offset))).unique()]
+            'items': items
         }
 
+    def _get_sort_key_query(self, reverse: bool = False) -> Select:
+        '''Distinct sort keys (the sort columns, primary key last) in sort order.'''
+        order_by = [column.desc() if descending != reverse else column.asc() for column, descending in self.sort]
+        return self.query.with_only_columns(*[column for column, _ in self.sort]).distinct().order_by(*order_by)
+
+    async def _get_items(self) -> list:
+        # LIMIT applies to distinct primary keys, not to rows multiplied by joins
+        # to collections, so pages are always full and at most per_page + 1 ids long
+        query = self._get_sort_key_query().limit(self.limit + 1).offset(self.offset)
+        ids = [key[-1] for key in (await self.db.execute(query)).all()]
+        self.has_more = len(ids) > self.limit
+        return await self._load_items(ids[:self.limit])
+
+    async def _load_items(self, ids: list) -> list:
+        '''Second phase: load the entities of a page of ids, in the same order.'''
+        if not ids:
+            return []
+        query = select(self.primary_entity).where(self.primary_key.in_(ids)).options(*self.load_options)
+        items = {getattr(item, self.primary_key.key): item for item in (await self.db.scalars(query)).unique()}
+        return [items[id] for id in ids if id in items]
+
     def _get_number_of_pages(self, count: int) -> int:
         rest = count % self.per_page
         quotient = count // self.per_page
         return quotient if not rest else quotient + 1
 
+    def _get_primary_key_query(self) -> Select:
+        return self.query.with_only_columns(self.primary_key).distinct()
 
-    async def _get_total_count(self) -> int:
-        primary_key = self.primary_entity.__table__.primary_key.columns.values()[0]
-        subquery = self.query.subquery()
-        count_query = select(func.count(distinct(subquery.c[primary_key.name])))
-        count = await self.db.scalar(count_query)
+    async def _get_total_count(self) -> Optional[int]:
+        if self.count_strategy == 'none':
+            return None
+        elif self.count_strategy == 'cached':
+            count = await self._get_cached_count()
+        elif self.count_strategy == 'estimated':
+            count = await self._get_estimated_count()
+        else:
+            count = await self._get_exact_count()
         self.number_of_pages = self._get_number_of_pages(count)
         return count
 
+    async def _get_exact_count(self) -> int:
+        count_query = self.query.with_only_columns(func.count(distinct(self.primary_key))).order_by(None)
+        return await self.db.scalar(count_query)
+
+    async def _get_cached_count(self) -> int:
+        compiled = self.query.compile(dialect=postgresql.dialect())
+        params = repr(sorted(compiled.params.items()))
+        digest = hashlib.sha256(f"{compiled.string}|{params}".encode()).hexdigest()
+        key = f"count:{self.primary_entity.__tablename__}:{digest}"
+
+        try:
+            cached = await execute(lambda redis: redis.get(key))
+            if cached is not None:
+                return int(cached)
+        except RedisError as e:
+            logging.warning(f"Count cache read error: {e}")
+
+        count = await self._get_exact_count()
+        try:
+            await execute(lambda redis: redis.set(key, count, ex=settings.PAGINATION_COUNT_CACHE_TTL))
+        except RedisError as e:
+            logging.warning(f"Count cache write error: {e}")
+        return count
+
+    async def _get_estimated_count(self) -> int:
+        table = self.primary_entity.__table__
+        if self.query.whereclause is None and self.query.get_final_froms() == [table]:
+            reltuples = await self.db.scalar(
+                text("SELECT reltuples FROM pg_class WHERE oid = CAST(:table AS regclass)"),
+                {'table': table.name}
+            )
+            # -1 (or 0 on old versions) until the table has been vacuumed/analyzed
+            if reltuples is not None and reltuples > 0:
+                return int(reltuples)
+            return await self._get_exact_count()
+
+        connection = await self.db.connection()
+        statement = self._get_primary_key_query().compile(
+            dialect=connection.dialect, compile_kwargs={'literal_binds': True}
+        )
+        plan = (await connection.exec_driver_sql(f"EXPLAIN (FORMAT JSON) {statement}")).scalar()
+        if isinstance(plan, str):
+            plan = json.loads(plan)
+        return int(plan[0]['Plan']['Plan Rows'])
+
+
+class KeysetPaginator(Paginator):
+    '''Cursor pagination over the sort key (the sort columns plus the primary
+    key, by default (created_at, id)). Pages are fetched with a range condition
+    on that key instead of an OFFSET, so the cost of a page doesn't depend on
+    how deep it is. Cursors are signed and opaque to clients; `next_page`/
+    `previous_page` links carry them. Sort columns must not be nullable.'''
+
+    def __init__(self, db: AsyncSession, query: Select, cursor: Optional[str], per_page: int, primary_entity: Type[BaseModel],
+                 count_strategy: str = 'exact', load_options: Optional[List[Any]] = None,
+                 sort: Optional[List[Tuple[Any, bool]]] = None):
+        super().__init__(db, query, 1, per_page, primary_entity, count_strategy, load_options,
+                         sort or [(primary_entity.created_at, False)])
+        # NULLs can't be encoded in a cursor nor compared in the range condition
+        nullable = [column.key for column, _ in self.sort if getattr(column.expression, 'nullable', False)]
+        if nullable:
+            raise ValueError(f"Keyset pagination can't sort by nullable columns: {', '.join(nullable)}")
+        self.sort_key = tuple_(*[column for column, _ in self.sort])
+        self.descending = self.sort[0][1]
+        self.direction, self.position = self._decode_cursor(cursor) if cursor else ('next', None)
+
+    def _encode_cursor(self, direction: str, key) -> str:
+        values = [value.isoformat() if isinstance(value, datetime) else value for value in key]
+        return encrypt([direction, *values])
+
+    def _decode_cursor(self, cursor: str) -> Tuple[str, Tuple[Any, ...]]:
+        try:
+            direction, *values = decrypt(cursor)
+            if direction not in ('next', 'previous') or len(values) != len(self.sort):
+                raise ValueError(direction)
+            position = tuple(
+                datetime.fromisoformat(value) if isinstance(column.type, DateTime) else column.type.python_type(value)
+                for (column, _), value in zip(self.sort, values)
+            )
+            return direction, position
+        except (BadSignature, TypeError, ValueError):
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid cursor")
+
+    def _get_page_url(self, direction: str, key) -> str:
+        url = self.request.url.remove_query_params('page').include_query_params(
+            cursor=self._encode_cursor(direction, key)
+        )
+        return str(url)
+
+    async def _get_items(self) -> list:
+        # walking backwards means reading the sort order in reverse
+        reverse = self.direction == 'previous'
+        query = self._get_sort_key_query(reverse)
+        if self.position is not None:
+            if self.descending != reverse:
+                query = query.where(self.sort_key < tuple_(*self.position))
+            else:
+                query = query.where(self.sort_key > tuple_(*self.position))
+
+        # fetch one more key to know whether there is another page in this direction
+        keys = (await self.db.execute(query.limit(self.per_page + 1))).all()
+        has_more = len(keys) > self.per_page
+        keys = keys[:self.per_page]
+        if reverse:
+            keys.reverse()
+        items = await self._load_items([key[-1] for key in keys])
+
+        if keys:
+            has_next = has_more if self.direction == 'next' else True
+            has_previous = has_more if self.direction == 'previous' else self.position is not None
+            self.next_page = self._get_page_url('next', keys[-1]) if has_next else None
+            self.previous_page = self._get_page_url('previous', keys[0]) if has_previous else None
+        else:
+            self.next_page = self.previous_page = None
+        return items
+
+    async def get_response(self) -> dict:
+        count = await self._get_total_count()
+        items = await self._get_items()
+        return {
+            'count': count,
+            'number_of_pages': self.number_of_pages,
+            'next_page': self.next_page,
+            'previous_page': self.previous_page,
+            'items': items
+        }
+
+
 class PaginatedResponse(BaseModel, Generic[M]):
-    count: int = Field(description='Number of total items')
+    count: Optional[int] = Field(description='Number of total items, estimated or omitted depending on the count strategy')
     items: List[M] = Field(description='List of items returned in a paginated response')
     next_page: Optional[AnyHttpUrl] = Field(None, description='url of the next page if it exists')
     previous_page: Optional[AnyHttpUrl] = Field(None, description='url of the previous page if it exists')
@@ -1,47 +1,292 @@
-from functools import wraps
+import logging
+import math
 import time
-from redis import asyncio as aioredis
-from fastapi import HTTPException, Request, status
+from typing import Dict, List, Optional, Tuple
+from fastapi import status
+from fastapi.responses import JSONResponse
+from redis.exceptions import RedisError
+from starlette.datastructures import MutableHeaders
+from starlette.routing import BaseRoute, Match
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+from app.common.metrics import metrics
+from app.common.redis import CircuitOpenError, execute, get_redis
+from app.schemas import StandardResponse
 from config import settings
 
+
+# Sliding window counter: the previous window's count is weighted by how much of
+# it still overlaps the sliding window. Memory is a single three-field hash per
+# key, and the whole check-and-increment is one atomic round trip. Up to `cost`
+# requests are granted at once, which the hybrid backend uses to lease quota.
+SLIDING_WINDOW_SCRIPT = """
+local key = KEYS[1]
+local limit = tonumber(ARGV[1])
+local window = tonumber(ARGV[2])
+local cost = tonumber(ARGV[3])
+local time = redis.call('TIME')
+local now = tonumber(time[1]) + tonumber(time[2]) / 1000000
+local current_window = math.floor(now / window)
+
+local state = redis.call('HMGET', key, 'window', 'current', 'previous')
+local stored_window = tonumber(state[1])
+local current = tonumber(state[2]) or 0
+local previous = tonumber(state[3]) or 0
+
+if stored_window == nil or stored_window < current_window - 1 then
+    previous = 0
+    current = 0
+elseif stored_window == current_window - 1 then
+    previous = current
+    current = 0
+end
+
+local elapsed = now - current_window * window
+local weighted = previous * (window - elapsed) / window + current
+local reset = window - elapsed
+
+local granted = math.min(cost, math.max(0, math.ceil(limit - weighted)))
+local retry_after = 0
+if granted > 0 then
+    current = current + granted
+    weighted = weighted + granted
+elseif current < limit and previous > 0 then
+    retry_after = window * (1 - (limit - current) / previous) - elapsed
+else
+    retry_after = reset
+end
+
+redis.call('HSET', key, 'window', current_window, 'current', current, 'previous', previous)
+redis.call('EXPIRE', key, window * 2)
+
+return {granted, math.max(0, math.floor(limit - weighted)), math.ceil(reset), math.ceil(retry_after)}
+"""
+
+
+class RateLimitResult:
+    def __init__(self, allowed: bool, limit: int, remaining: int, reset: int, retry_after: int, granted: int = 1):
+        self.allowed = allowed
+        self.limit = limit
+        self.remaining = remaining
+        self.reset = reset
+        self.retry_after = retry_after
+        self.granted = granted
+
+    @property
+    def headers(self) -> Dict[str, str]:
+        headers = {
+            "X-RateLimit-Limit": str(self.limit),
+            "X-RateLimit-Remaining": str(self.remaining),
+            "X-RateLimit-Reset": str(self.reset),
+        }
+        if not self.allowed:
+            headers["Retry-After"] = str(max(self.retry_after, 1))
+        return headers
+
+
+class RateLimitBackend:
+    async def hit(self, key: str, max_requests: int, window: int, cost: int = 1) -> RateLimitResult:
+        raise NotImplementedError  # Override in subclass
+
+
+class RedisRateLimitBackend(RateLimitBackend):
+    '''Shared limits in Redis. When Redis is unavailable (or its circuit breaker
+    is open) requests are either let through (`failure_mode="open"`) or limited
+    per worker by `fallback` (`failure_mode="local"`), instead of failing.'''
+
+    def __init__(self, failure_mode: str = "local", fallback: Optional[RateLimitBackend] = None):
+        self.script = None
+        self.failure_mode = failure_mode
+        self.fallback = fallback
+
+    async def hit(self, key: str, max_requests: int, window: int, cost: int = 1) -> RateLimitResult:
+        if self.script is None:
+            # EVALSHA, falling back to EVAL (which caches the script) on NOSCRIPT
+            self.script = get_redis().register_script(SLIDING_WINDOW_SCRIPT)
+
+        try:
+            granted, remaining, reset, retry_after = await execute(
+                lambda redis: self.script(keys=[key], args=[max_requests, window, cost], client=redis)
+            )
+        except RedisError as e:
+            metrics.increment(f"rate_limit.redis_unavailable.{self.failure_mode}")
+            if not isinstance(e, CircuitOpenError):
+                logging.warning(f"Rate limiting without Redis ({self.failure_mode}): {e}")
+            if self.failure_mode == "local" and self.fallback is not None:
+                return await self.fallback.hit(key, max_requests, window, cost)
+            return RateLimitResult(True, max_requests, max_requests, window, 0, cost)
+        return RateLimitResult(granted > 0, max_requests, remaining, reset, retry_after, granted)
+
+
+class MemoryRateLimitBackend(RateLimitBackend):
+    '''The same sliding window counter kept in process memory. Limits are per
+    worker, so it is meant for tests and single-process deployments.'''
+
+    MAX_KEYS = 10000
+
+    def __init__(self):
+        self.state: Dict[str, list] = {}
+
+    def _purge(self, now: float) -> None:
+        # drop keys whose windows can no longer affect any decision
+        self.state = {key: value for key, value in self.state.items() if value[3] > now}
+
+    async def hit(self, key: str, max_requests: int, window: int, cost: int = 1) -> RateLimitResult:
+        now = time.time()
+        if len(self.state) > self.MAX_KEYS:
+            self._purge(now)
+
+        current_window = math.floor(now / window)
+        stored_window, current, previous, _ = self.state.get(key, (None, 0, 0, 0))
+        if stored_window is None or stored_window < current_window - 1:
+            previous, current = 0, 0
+        elif stored_window == current_window - 1:
+            previous, current = current, 0
+
+        elapsed = now - current_window * window
+        weighted = previous * (window - elapsed) / window + current
+        reset = window - elapsed
+
+        granted = min(cost, max(0, math.ceil(max_requests - weighted)))
+        retry_after = 0
+        if granted > 0:
+            current += granted
+            weighted += granted
+        elif current < max_requests and previous > 0:
+            retry_after = window * (1 - (max_requests - current) / previous) - elapsed
+        else:
+            retry_after = reset
+
+        self.state[key] = [current_window, current, previous, now + window * 2]
+        return RateLimitResult(granted > 0, max_requests, max(0, math.floor(max_requests - weighted)),
+                               math.ceil(reset), math.ceil(retry_after), granted)
+
+
+class HybridRateLimitBackend(RateLimitBackend):
+    '''Leases quota from a shared backend in batches and spends it from a local
+    bucket, so only about one request in `lease_fraction * max_requests` reaches
+    Redis. Leased tokens count against the shared limit as soon as they are
+    leased and expire unused after one window, so the larger the lease the more
+    unevenly the limit is shared between workers.'''
+
+    MAX_KEYS = 10000
+
+    def __init__(self, shared_backend: RateLimitBackend, lease_fraction: float):
+        self.shared_backend = shared_backend
+        self.lease_fraction = lease_fraction
+        self.buckets: Dict[str, list] = {}
+
+    def _lease_size(self, max_requests: int) -> int:
+        return max(1, int(max_requests * self.lease_fraction))
+
+    async def hit(self, key: str, max_requests: int, window: int, cost: int = 1) -> RateLimitResult:
+        now = time.monotonic()
+        bucket = self.buckets.get(key)
+        if bucket is not None and bucket[1] <= now:
+            bucket = None
+
+        if bucket is None or bucket[0] < cost:
+            if len(self.buckets) > self.MAX_KEYS:
+                self.buckets = {k: value for k, value in self.buckets.items() if value[1] > now}
+
+            lease_size = max(cost, self._lease_size(max_requests))
+            result = await self.shared_backend.hit(key, max_requests, window, lease_size)
+            tokens = (bucket[0] if bucket is not None else 0) + result.granted
+            if tokens < cost:
+                result.allowed = False
+                return result
+            bucket = [tokens, now + window, result.remaining]
+            self.buckets[key] = bucket
+
+        bucket[0] -= cost
+        return RateLimitResult(True, max_requests, bucket[0] + bucket[2], math.ceil(bucket[1] - now), 0, cost)
+
+
+def get_rate_limit_backend(name: str) -> RateLimitBackend:
+    if name == "redis":
+        return RedisRateLimitBackend(settings.RATE_LIMIT_FAILURE_MODE, MemoryRateLimitBackend())
+    elif name == "hybrid":
+        redis_backend = RedisRateLimitBackend(settings.RATE_LIMIT_FAILURE_MODE, MemoryRateLimitBackend())
+        return HybridRateLimitBackend(redis_backend, settings.RATE_LIMIT_LEASE_FRACTION)
+    elif name == "memory":
+        return MemoryRateLimitBackend()
+    raise ValueError(f"Unknown rate limit backend '{name}'")
+
+
 class RateLimiter:
-    async def init_redis(self):
-        self.redis = await aioredis.from_url(settings.REDIS_HOST)
+    def __init__(self, backend: RateLimitBackend):
+        self.backend = backend
+
+    async def hit(self, key: str, max_requests: int, window: int) -> RateLimitResult:
+        return await self.backend.hit(key, max_requests, window)
 
     async def is_rate_limited(self, key: str, max_requests: int, window: int) -> bool:
-        if not hasattr(self, "redis"):
-            await self.init_redis()
-
-        current = int(time.time())
-        window_start = current - window
-        async with self.redis.pipeline(transaction=True) as pipe:
-            try:
-                pipe.zremrangebyscore(key, 0, window_start)
-                pipe.zadd(key, {current: current})
-                pipe.zcard(key)
-                pipe.expire(key, window)
-                results = await pipe.execute()
-            except self.redis.RedisError as e:
-                raise HTTPException(
-                    status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-                    detail=f"Redis error: {str(e)}"
-                ) from e
-        return results[2] > max_requests
-
-
-rate_limiter = RateLimiter()
-
-
-def rate_limit(max_requests: int, window: int):
-    def decorator(func):
-        @wraps(func)
-        async def wrapper(request: Request, *args, **kwargs):
-            key = f"rate_limit:{request.client.host}:{request.url.path}"
-            if await rate_limiter.is_rate_limited(key, max_requests, window):
-                raise HTTPException(
-                    status_code=status.HTTP_429_TOO_MANY_REQUESTS,
-                    detail="Too many requests"
-                )
-            return await func(request, *args, **kwargs)
-        return wrapper
-    return decorator
\ No newline at end of file
+        return not (await self.hit(key, max_requests, window)).allowed
+
+
+rate_limiter = RateLimiter(get_rate_limit_backend(settings.RATE_LIMIT_BACKEND))
+
+
+class RateLimitMiddleware:
+    '''Pure ASGI middleware enforcing the RATE_LIMIT_POLICIES table before the
+    request body is read or any dependency is resolved. Policies are keyed by
+    "METHOD /route/{template}", and so are the counters, together with the
+    client address, so every user id of a parameterized route shares a budget.'''
+
+    def __init__(self, app: ASGIApp, policies: Optional[Dict[str, Tuple[int, int]]] = None):
+        self.app = app
+        self.policies = settings.RATE_LIMIT_POLICIES if policies is None else policies
+        self.limited_routes = None
+
+    def _get_limited_routes(self, scope: Scope) -> List[Tuple[BaseRoute, str, Tuple[int, int]]]:
+        # resolved once, the first time the application routes are available
+        if self.limited_routes is None:
+            self.limited_routes = []
+            for route in scope["app"].routes:
+                for method in getattr(route, "methods", None) or []:
+                    policy_key = f"{method} {route.path}"
+                    if policy_key in self.policies:
+                        self.limited_routes.append((route, policy_key, self.policies[policy_key]))
+        return self.limited_routes
+
+    def _match(self, scope: Scope) -> Optional[Tuple[str, Tuple[int, int]]]:
+        for route, policy_key, policy in self._get_limited_routes(scope):
+            match, _ = route.matches(scope)
+            if match == Match.FULL:
+                return policy_key, policy
+        return None
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http" or not self.policies:
+            await self.app(scope, receive, send)
+            return
+
+        matched = self._match(scope)
+        if matched is None:
+            await self.app(scope, receive, send)
+            return
+
+        policy_key, (max_requests, window) = matched
+        client = scope.get("client")
+        key = f"rate_limit:{policy_key}:{client[0] if client else 'unknown'}"
+        result = await rate_limiter.hit(key, max_requests, window)
+        if not result.allowed:
+            await self._reject(scope, receive, send, status.HTTP_429_TOO_MANY_REQUESTS, "Too many requests", result.headers)
+            return
+
+        async def send_with_headers(message: Message) -> None:
+            if message["type"] == "http.response.start":
+                headers = MutableHeaders(scope=message)
+                for name, value in result.headers.items():
+                    headers.append(name, value)
+            await send(message)
+
+        await self.app(scope, receive, send_with_headers)
+
+    async def _reject(self, scope: Scope, receive: Receive, send: Send, status_code: int, message: str,
+                      headers: Optional[Dict[str, str]] = None) -> None:
+        response = JSONResponse(
+            status_code=status_code,
+            content=StandardResponse(status=status_code, message=message, result=None).model_dump(),
+            headers=headers
+        )
+        await response(scope, receive, send)
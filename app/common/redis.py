@@ -0,0 +1,67 @@
+import time
+from typing import Awaitable, Callable, Optional, TypeVar
+from redis import asyncio as aioredis
+from redis.exceptions import ConnectionError, RedisError, TimeoutError
+from app.common.circuit_breaker import CircuitBreaker
+from app.common.metrics import metrics
+from config import settings
+
+
+R = TypeVar('R')
+
+
+class CircuitOpenError(RedisError):
+    pass
+
+
+_redis: Optional[aioredis.Redis] = None
+
+redis_breaker = CircuitBreaker(
+    'redis',
+    failure_threshold=settings.REDIS_BREAKER_FAILURE_THRESHOLD,
+    reset_timeout=settings.REDIS_BREAKER_RESET_TIMEOUT,
+)
+
+
+def get_redis() -> aioredis.Redis:
+    '''Application-wide client. It is created in the app lifespan; creating it
+    here as well keeps it usable where the lifespan doesn't run (e.g. tests).'''
+    global _redis
+    if _redis is None:
+        pool = aioredis.ConnectionPool.from_url(
+            settings.REDIS_HOST,
+            max_connections=settings.REDIS_MAX_CONNECTIONS,
+            socket_timeout=settings.REDIS_SOCKET_TIMEOUT,
+            socket_connect_timeout=settings.REDIS_SOCKET_CONNECT_TIMEOUT,
+        )
+        _redis = aioredis.Redis(connection_pool=pool)
+    return _redis
+
+
+async def close_redis() -> None:
+    global _redis
+    if _redis is not None:
+        await _redis.aclose(close_connection_pool=True)
+        _redis = None
+
+
+async def execute(command: Callable[[aioredis.Redis], Awaitable[R]]) -> R:
+    '''Runs `command` against the shared client behind the Redis circuit breaker.
+    Raises CircuitOpenError (a RedisError) without calling Redis while it is open.'''
+    if not redis_breaker.allow():
+        raise CircuitOpenError("Redis circuit breaker is open")
+
+    started_at = time.perf_counter()
+    try:
+        result = await command(get_redis())
+    except (ConnectionError, TimeoutError):
+        redis_breaker.record_failure()
+        raise
+    except RedisError:
+        # an error reply (e.g. a ResponseError) means Redis is reachable
+        redis_breaker.record_success()
+        raise
+    finally:
+        metrics.observe("redis.latency_seconds", time.perf_counter() - started_at)
+    redis_breaker.record_success()
+    return result
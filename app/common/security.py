@@ -1,5 +1,10 @@
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+from fastapi import HTTPException, status
 from passlib.context import CryptContext
 from itsdangerous import URLSafeTimedSerializer
+from app.common.metrics import metrics
 from config import settings
 
 
@@ -21,3 +26,67 @@ def verify_password(plain_password, hashed_password):
 
 def get_password_hash(password):
     return pwd_context.hash(password)
+
+
+class PasswordHasher:
+    '''Runs bcrypt on a dedicated thread pool so it doesn't block the event loop.
+    At most `max_concurrency` hashes run at once; callers that can't get a slot
+    within `queue_timeout` seconds get a 503 instead of piling up work.'''
+
+    def __init__(self, max_concurrency: int, queue_timeout: float):
+        self.queue_timeout = queue_timeout
+        self.executor = ThreadPoolExecutor(max_workers=max_concurrency, thread_name_prefix="password_hasher")
+        self.semaphore = asyncio.Semaphore(max_concurrency)
+        self.waiting = 0
+
+    async def _acquire(self) -> bool:
+        '''Whether a slot was acquired within `queue_timeout`. Before Python 3.12,
+        wait_for can drop an acquire that succeeds just as it times out, which
+        would leak the slot; a cancelled acquire hands its slot on instead.'''
+        acquire = asyncio.ensure_future(self.semaphore.acquire())
+        try:
+            await asyncio.wait([acquire], timeout=self.queue_timeout)
+        except BaseException:
+            if acquire.done():
+                self.semaphore.release()
+            else:
+                acquire.cancel()
+            raise
+        if not acquire.done():
+            acquire.cancel()
+            return False
+        return True
+
+    async def _run(self, func, *args):
+        self.waiting += 1
+        metrics.set_gauge("password_hasher.queue_depth", self.waiting)
+        queued_at = time.perf_counter()
+        try:
+            acquired = await self._acquire()
+        finally:
+            self.waiting -= 1
+            metrics.set_gauge("password_hasher.queue_depth", self.waiting)
+        if not acquired:
+            metrics.increment("password_hasher.rejected")
+            raise HTTPException(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                detail="Server busy, please try again later"
+            )
+
+        started_at = time.perf_counter()
+        metrics.observe("password_hasher.wait_seconds", started_at - queued_at)
+        try:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self.executor, func, *args)
+        finally:
+            self.semaphore.release()
+            metrics.observe("password_hasher.hash_seconds", time.perf_counter() - started_at)
+
+    async def hash(self, password: str) -> str:
+        return await self._run(get_password_hash, password)
+
+    async def verify(self, plain_password: str, hashed_password: str) -> bool:
+        return await self._run(verify_password, plain_password, hashed_password)
+
+
+password_hasher = PasswordHasher(settings.PASSWORD_HASHING_MAX_CONCURRENCY, settings.PASSWORD_HASHING_QUEUE_TIMEOUT)
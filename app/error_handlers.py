@@ -23,7 +23,8 @@ async def http_exception_handler(request, exc: HTTPException):
             status=exc.status_code,
             message=exc.detail,
             result=None
-        ).model_dump()
+        ).model_dump(),
+        headers=getattr(exc, "headers", None)
     )
 
 
@@ -34,5 +35,6 @@ async def starlette_http_exception_handler(request, exc: StarletteHTTPException)
             status=exc.status_code,
             message=exc.detail,
             result=None
-        ).model_dump()
+        ).model_dump(),
+        headers=getattr(exc, "headers", None)
     )
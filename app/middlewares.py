@@ -1,9 +1,17 @@
+import hashlib
+import logging
 from starlette.middleware.base import BaseHTTPMiddleware, RequestResponseEndpoint
+from starlette.datastructures import Headers
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
 from contextvars import ContextVar
+from redis.exceptions import RedisError
 from starlette.requests import Request
 from starlette.responses import Response
 from starlette.middleware import Middleware
 from fastapi.middleware.cors import CORSMiddleware
+from app.common.rate_limiting import RateLimitMiddleware
+from app.common.db import replica_engines, use_replica
+from app.common.redis import execute
 from config import settings
 
 
@@ -17,10 +25,56 @@ class RequestToContextMiddleware(BaseHTTPMiddleware):
         return response
 
 
+class ReplicaRoutingMiddleware:
+    '''Lets GET/HEAD/OPTIONS requests read from replicas, unless the same client (bearer
+    token, or address when anonymous) made a successful write less than
+    DB_REPLICA_PIN_SECONDS ago, so clients always read their own writes.'''
+
+    SAFE_METHODS = ("GET", "HEAD", "OPTIONS")
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    def _pin_key(self, scope: Scope) -> str:
+        identity = Headers(scope=scope).get("authorization")
+        if not identity:
+            client = scope.get("client")
+            identity = client[0] if client else "unknown"
+        return "db_pin:" + hashlib.sha256(identity.encode()).hexdigest()
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http" or not replica_engines:
+            await self.app(scope, receive, send)
+            return
+
+        pin_key = self._pin_key(scope)
+        if scope["method"] in self.SAFE_METHODS:
+            try:
+                pinned = await execute(lambda redis: redis.exists(pin_key))
+            except RedisError:
+                pinned = True
+            use_replica.set(not pinned)
+            await self.app(scope, receive, send)
+            return
+
+        async def send_and_pin(message: Message) -> None:
+            if message["type"] == "http.response.start" and message["status"] < 400:
+                try:
+                    await execute(lambda redis: redis.set(pin_key, 1, ex=settings.DB_REPLICA_PIN_SECONDS))
+                except RedisError as e:
+                    logging.warning(f"Could not pin client to the primary database: {e}")
+            await send(message)
+
+        use_replica.set(False)
+        await self.app(scope, receive, send_and_pin)
+
+
 cors_origins = settings.CORS_ORIGINS.split(',')
 
 
 middlewares = [
     Middleware(RequestToContextMiddleware),
-    Middleware(CORSMiddleware, allow_origins=cors_origins, allow_methods=["*"], allow_headers=["*"])
+    Middleware(CORSMiddleware, allow_origins=cors_origins, allow_methods=["*"], allow_headers=["*"]),
+    Middleware(RateLimitMiddleware),
+    Middleware(ReplicaRoutingMiddleware)
 ]
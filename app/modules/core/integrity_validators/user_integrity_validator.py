@@ -1,45 +1,34 @@
 from datetime import datetime, timedelta
-from typing import Any, List
+from typing import List, Optional
 from app.modules.core.repositories.user_repository import UserRepository
 from app.modules.core.schemas.user_schemas import UserBase, UserCreate, UserUpdate
 from app.schemas import ValidationErrorSchema
 from config import settings
-from app.modules.core.services.country_service import CountryService
-from app.modules.core.services.role_service import RoleService
 
 
 class UserIntegrityValidator:
-    def __init__(self, user_repository: UserRepository, role_service: RoleService, country_service: CountryService):
+    def __init__(self, user_repository: UserRepository):
         self.repository = user_repository
-        self.role_service = role_service
-        self.country_service = country_service
 
-    async def user_data_already_exists(self, field: str, value: Any, clean_up_non_active: bool = False) -> bool:
-        users = await self.repository.get_by_field(field, value)
-
-        if not users:
-            return False
-
-        timeout_duration = timedelta(seconds=settings.ACCOUNT_ACTIVATION_TIMEOUT)
-        account_creation_limit = datetime.utcnow() - timeout_duration
-        for user in users:
-            user = user[0]
-            if user.active:
-                return True
+    async def validate_data_base(self, user_data: UserBase) -> List[ValidationErrorSchema]:
+        return await self._validate(user_data)
 
-            if user.created_at > account_creation_limit:
-                return True
+    async def validate_data_create(self, user_data: UserCreate) -> List[ValidationErrorSchema]:
+        return await self._validate(user_data, email=user_data.email, username=user_data.username)
 
-        # only clean up if users are not active and timeout has passed
-        if clean_up_non_active:
-            for user in users:
-                await self.repository.delete(user)
+    async def validate_data_update(self, user_data: UserUpdate) -> List[ValidationErrorSchema]:
+        return await self._validate(user_data)
 
-        return False        
+    async def _validate(self, user_data: UserBase, email: Optional[str] = None,
+                        username: Optional[str] = None) -> List[ValidationErrorSchema]:
+        # every check in a single round trip, see UserRepository.get_integrity_state
+        reserved_since = datetime.utcnow() - timedelta(seconds=settings.ACCOUNT_ACTIVATION_TIMEOUT)
+        state = await self.repository.get_integrity_state(
+            user_data.country_id, user_data.role_ids, reserved_since, email, username
+        )
 
-    async def validate_data_base(self, user_data: UserBase) -> List[ValidationErrorSchema]:
         validation_errors = []
-        if await self.country_service.get_first_by_field('id', user_data.country_id) is None:
+        if not state.country_exists:
             validation_errors.append(
                 ValidationErrorSchema(
                     loc=("body", "country_id",),
@@ -48,8 +37,9 @@ class UserIntegrityValidator:
                 )
             )
 
+        existing_role_ids = set(state.role_ids or [])
         for role_id in user_data.role_ids:
-            if await self.role_service.get_first_by_field('id', role_id) is None:
+            if role_id not in existing_role_ids:
                 validation_errors.append(
                     ValidationErrorSchema(
                         loc=("body", "role_id",),
@@ -58,12 +48,7 @@ class UserIntegrityValidator:
                     )
                 )
 
-        return validation_errors
-
-    async def validate_data_create(self, user_data: UserCreate) -> List[ValidationErrorSchema]:
-        validation_errors = await self.validate_data_base(user_data)
-
-        if await self.user_data_already_exists("email", user_data.email):
+        if email is not None and state.email_taken:
             validation_errors.append(
                 ValidationErrorSchema(
                     loc=("body", "email",),
@@ -72,7 +57,7 @@ class UserIntegrityValidator:
                 )
             )
 
-        if await self.user_data_already_exists("username", user_data.username):
+        if username is not None and state.username_taken:
             validation_errors.append(
                 ValidationErrorSchema(
                     loc=("body", "username",),
@@ -82,8 +67,3 @@ class UserIntegrityValidator:
             )
 
         return validation_errors
-
-    async def validate_data_update(self, user_data: UserUpdate) -> List[ValidationErrorSchema]:
-        validation_errors = await self.validate_data_base(user_data)
-
-        return validation_errors
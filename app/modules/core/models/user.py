@@ -1,6 +1,24 @@
-from sqlalchemy import Column, Integer, String, Boolean, ForeignKey, DateTime
+from sqlalchemy import DDL, Column, Integer, String, Boolean, ForeignKey, DateTime, Index, Text, event
+from sqlalchemy.dialects.postgresql import ARRAY
 from sqlalchemy.orm import relationship
 from app.common.base_model import BaseModel
+from app.common.db import Base
+from app.common.filtering import search_expression
+
+
+def search_index(name: str, *columns) -> Index:
+    '''Trigram GIN index on search_expression(*columns), the expression the
+    enhanced_ilike filters compare against.'''
+    return Index(
+        name, search_expression(*columns).label(name),
+        postgresql_using='gin', postgresql_ops={name: 'gin_trgm_ops'}
+    )
+
+
+def prefix_index(name: str, *columns) -> Index:
+    '''B-tree index on search_expression(*columns) COLLATE "C": serves the
+    prefix range scans (and their ordering) of the suggest endpoints.'''
+    return Index(name, search_expression(*columns).collate('C'))
 
 
 class Country(BaseModel):
@@ -11,6 +29,11 @@ class Country(BaseModel):
 
     users = relationship("User", back_populates="country")
 
+    __table_args__ = (
+        search_index('ix_countries_name_search', name),
+        prefix_index('ix_countries_name_prefix', name),
+    )
+
 
 class RolePermission(BaseModel):
     __tablename__ = "roles_permissions"
@@ -35,6 +58,10 @@ class Role(BaseModel):
     permissions = relationship("Permission", secondary="roles_permissions", back_populates="roles")
     users = relationship("User", secondary="users_roles", back_populates="roles")
 
+    __table_args__ = (
+        search_index('ix_roles_name_search', name),
+    )
+
 
 class UserRole(BaseModel):
     __tablename__ = "users_roles"
@@ -46,14 +73,147 @@ class UserRole(BaseModel):
 class User(BaseModel):
     __tablename__ = "users"
 
-    username = Column(String(50), unique=True)
+    username = Column(String(50), unique=True, nullable=False)
     password_hash = Column(String)
     name = Column(String(50), nullable=True)
     surname = Column(String(50), nullable=True)
-    email = Column(String(255), unique=True)
+    email = Column(String(255), unique=True, nullable=False)
     country_id = Column(Integer, ForeignKey('countries.id'), nullable=True)
     photo_path = Column(String, nullable=True)
     active = Column(Boolean, default=False)
+    # bumped with every change to the user's claims (see services/auth_version.py)
+    auth_version = Column(Integer, nullable=False, default=0, server_default='0')
 
     country = relationship("Country", back_populates="users")
     roles = relationship("Role", secondary="users_roles", back_populates="users")
+    search = relationship("UserSearch", uselist=False, viewonly=True)
+
+    __table_args__ = (
+        search_index('ix_users_full_name_search', name, surname),
+        search_index('ix_users_username_search', username),
+        search_index('ix_users_email_search', email),
+        prefix_index('ix_users_full_name_prefix', name, surname),
+        prefix_index('ix_users_username_prefix', username),
+        # sort=<field> pages, with id as the tiebreaker (see UserFilters.sortable_fields)
+        Index('ix_users_username_id', username, 'id'),
+        Index('ix_users_email_id', email, 'id'),
+        Index('ix_users_created_at_id', 'created_at', 'id'),
+    )
+
+
+class UserSearch(Base):
+    '''Read model for the admin user search: one row per user with its own,
+    its country's and its roles' searchable values already normalized as
+    search_expression does. Maintained by the triggers below (and the
+    "user search read model" migration), never written by the application.'''
+    __tablename__ = "user_search"
+
+    user_id = Column(Integer, ForeignKey('users.id', ondelete='CASCADE'), primary_key=True)
+    full_name = Column(Text, nullable=False)
+    username = Column(Text)
+    email = Column(Text)
+    country_name = Column(Text)
+    role_ids = Column(ARRAY(Integer), nullable=False)
+    # one normalized name per line
+    role_names = Column(Text, nullable=False)
+
+    __table_args__ = (
+        Index('ix_user_search_full_name', full_name, postgresql_using='gin', postgresql_ops={'full_name': 'gin_trgm_ops'}),
+        Index('ix_user_search_username', username, postgresql_using='gin', postgresql_ops={'username': 'gin_trgm_ops'}),
+        Index('ix_user_search_email', email, postgresql_using='gin', postgresql_ops={'email': 'gin_trgm_ops'}),
+        Index('ix_user_search_country_name', country_name, postgresql_using='gin',
+              postgresql_ops={'country_name': 'gin_trgm_ops'}),
+        Index('ix_user_search_role_names', role_names, postgresql_using='gin',
+              postgresql_ops={'role_names': 'gin_trgm_ops'}),
+        Index('ix_user_search_role_ids', role_ids, postgresql_using='gin'),
+    )
+
+
+USER_SEARCH_DDL = [
+    """
+    CREATE OR REPLACE FUNCTION refresh_user_search(user_ids integer[]) RETURNS void LANGUAGE sql AS $$
+        -- serializes refreshes of a user: under READ COMMITTED two transactions
+        -- changing its roles would otherwise each aggregate without the other's
+        -- change, and the last upsert would lose one. The INSERT below takes a
+        -- new snapshot, after the lock. NO KEY UPDATE doesn't conflict with the
+        -- KEY SHARE locks taken by foreign key checks on users_roles.
+        SELECT 1 FROM users WHERE id = ANY(user_ids) ORDER BY id FOR NO KEY UPDATE;
+        INSERT INTO user_search (user_id, full_name, username, email, country_name, role_ids, role_names)
+        SELECT users.id,
+               lower(immutable_unaccent(coalesce(users.name, '') || ' ' || coalesce(users.surname, ''))),
+               lower(immutable_unaccent(users.username)),
+               lower(immutable_unaccent(users.email)),
+               lower(immutable_unaccent(countries.name)),
+               coalesce(array_agg(roles.id ORDER BY roles.id) FILTER (WHERE roles.id IS NOT NULL), '{}'),
+               coalesce(string_agg(lower(immutable_unaccent(roles.name)), chr(10) ORDER BY roles.id), '')
+        FROM users
+        LEFT JOIN countries ON countries.id = users.country_id
+        LEFT JOIN users_roles ON users_roles.user_id = users.id
+        LEFT JOIN roles ON roles.id = users_roles.role_id
+        WHERE users.id = ANY(user_ids)
+        GROUP BY users.id, countries.name
+        ON CONFLICT (user_id) DO UPDATE SET
+            full_name = EXCLUDED.full_name,
+            username = EXCLUDED.username,
+            email = EXCLUDED.email,
+            country_name = EXCLUDED.country_name,
+            role_ids = EXCLUDED.role_ids,
+            role_names = EXCLUDED.role_names
+    $$
+    """,
+    """
+    CREATE OR REPLACE FUNCTION user_search_on_users() RETURNS trigger LANGUAGE plpgsql AS $$
+    BEGIN
+        PERFORM refresh_user_search(ARRAY[NEW.id]);
+        RETURN NULL;
+    END
+    $$
+    """,
+    """
+    CREATE TRIGGER user_search_on_users AFTER INSERT OR UPDATE OF name, surname, username, email, country_id
+    ON users FOR EACH ROW EXECUTE FUNCTION user_search_on_users()
+    """,
+    """
+    CREATE OR REPLACE FUNCTION user_search_on_users_roles() RETURNS trigger LANGUAGE plpgsql AS $$
+    BEGIN
+        IF TG_OP IN ('INSERT', 'UPDATE') THEN
+            PERFORM refresh_user_search(ARRAY[NEW.user_id]);
+        END IF;
+        IF TG_OP IN ('DELETE', 'UPDATE') THEN
+            PERFORM refresh_user_search(ARRAY[OLD.user_id]);
+        END IF;
+        RETURN NULL;
+    END
+    $$
+    """,
+    """
+    CREATE TRIGGER user_search_on_users_roles AFTER INSERT OR UPDATE OR DELETE
+    ON users_roles FOR EACH ROW EXECUTE FUNCTION user_search_on_users_roles()
+    """,
+    """
+    CREATE OR REPLACE FUNCTION user_search_on_countries() RETURNS trigger LANGUAGE plpgsql AS $$
+    BEGIN
+        PERFORM refresh_user_search(ARRAY(SELECT id FROM users WHERE country_id = NEW.id));
+        RETURN NULL;
+    END
+    $$
+    """,
+    """
+    CREATE TRIGGER user_search_on_countries AFTER UPDATE OF name
+    ON countries FOR EACH ROW EXECUTE FUNCTION user_search_on_countries()
+    """,
+    """
+    CREATE OR REPLACE FUNCTION user_search_on_roles() RETURNS trigger LANGUAGE plpgsql AS $$
+    BEGIN
+        PERFORM refresh_user_search(ARRAY(SELECT user_id FROM users_roles WHERE role_id = NEW.id));
+        RETURN NULL;
+    END
+    $$
+    """,
+    """
+    CREATE TRIGGER user_search_on_roles AFTER UPDATE OF name
+    ON roles FOR EACH ROW EXECUTE FUNCTION user_search_on_roles()
+    """,
+]
+for statement in USER_SEARCH_DDL:
+    event.listen(Base.metadata, 'after_create', DDL(statement).execute_if(dialect='postgresql'))
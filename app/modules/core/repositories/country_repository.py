@@ -1,7 +1,11 @@
 from app.common.base_repository import BaseRepository
+from app.common.filtering import search_expression
 from sqlalchemy.ext.asyncio.session import AsyncSession
 from app.modules.core.models.user import Country
 
 class CountryRepository(BaseRepository):
     def __init__(self, db: AsyncSession):
         super().__init__(db, Country)
+
+    async def suggest(self, prefix: str, limit: int) -> list:
+        return await self.suggest_by_prefix(prefix, [search_expression(Country.name)], Country.name, limit)
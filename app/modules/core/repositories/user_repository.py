@@ -1,7 +1,79 @@
+from datetime import datetime
+from typing import Iterable, List, Optional
+from sqlalchemy import Row, and_, exists, func, not_, or_, select
 from sqlalchemy.ext.asyncio.session import AsyncSession
+from sqlalchemy.orm import load_only
 from app.common.base_repository import BaseRepository
-from app.modules.core.models.user import User
+from app.common.filtering import search_expression
+from app.modules.core.models.user import Country, Role, User, UserRole
 
 class UserRepository(BaseRepository):
+    # what each UserResponse field needs loaded
+    RESPONSE_COLUMNS = {
+        'id': ['id'],
+        'username': ['username'],
+        'name': ['name'],
+        'surname': ['surname'],
+        'email': ['email'],
+        'photo_url': ['photo_path'],
+    }
+    RESPONSE_RELATIONSHIPS = {
+        'country': 'country',
+        'roles': 'roles',
+    }
+
     def __init__(self, db: AsyncSession):
         super().__init__(db, User)
+
+    def list_load_options(self) -> list:
+        # everything UserResponse needs: the country joined in the page query and
+        # all the roles of the page in a single extra query
+        return self._get_relationships_load_options(['country', 'roles'])
+
+    def response_load_options(self, fields: Optional[Iterable[str]] = None) -> list:
+        '''Loader options for a sparse UserResponse: only the columns behind
+        `fields` (plus id) and only the relationships among them. Everything
+        when `fields` is None.'''
+        if fields is None:
+            return self.list_load_options()
+        columns = {'id'}
+        for field in fields:
+            columns.update(self.RESPONSE_COLUMNS.get(field, []))
+        relationships = [self.RESPONSE_RELATIONSHIPS[field] for field in fields if field in self.RESPONSE_RELATIONSHIPS]
+        return [load_only(*[getattr(User, column) for column in sorted(columns)])] + \
+            self._get_relationships_load_options(relationships)
+
+    async def get_integrity_state(self, country_id: int, role_ids: List[int], reserved_since: datetime,
+                                  email: Optional[str] = None, username: Optional[str] = None) -> Row:
+        '''Everything needed to validate a user's references and unique fields,
+        as a single row: whether the country exists, which of the role ids
+        exist, and whether the email/username belong to an active user or to
+        one created after `reserved_since`.'''
+        reserved = or_(User.active, User.created_at > reserved_since)
+        columns = [
+            exists().where(Country.id == country_id).label('country_exists'),
+            select(func.array_agg(Role.id)).where(Role.id.in_(role_ids)).scalar_subquery().label('role_ids'),
+        ]
+        if email is not None:
+            columns.append(exists().where(User.email == email, reserved).label('email_taken'))
+        if username is not None:
+            columns.append(exists().where(User.username == username, reserved).label('username_taken'))
+        return (await self.db.execute(select(*columns))).one()
+
+    async def delete_stale_users(self, reserved_since: datetime, *criteria) -> int:
+        '''Deletes the inactive users matching `criteria` that were created
+        before `reserved_since`, with their roles, in two statements.'''
+        stale = and_(not_(User.active), User.created_at <= reserved_since, *criteria)
+        await self.db.execute(
+            UserRole.__table__.delete().where(UserRole.user_id.in_(select(User.id).where(stale)))
+        )
+        return await self.bulk_delete(stale)
+
+    async def suggest(self, prefix: str, limit: int) -> list:
+        # full name or username prefix, both on their ix_users_*_prefix indexes
+        return await self.suggest_by_prefix(
+            prefix,
+            [search_expression(User.name, User.surname), search_expression(User.username)],
+            func.concat_ws(' ', User.name, User.surname),
+            limit
+        )
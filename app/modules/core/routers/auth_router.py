@@ -3,14 +3,12 @@ from typing import List, Union
 from fastapi import APIRouter, Depends, Request, UploadFile, Form, File
 from fastapi.templating import Jinja2Templates
 from pydantic_core import ValidationError
-from app.modules.core.models.user import User
-from app.modules.core.schemas.auth_schemas import Token, LoginForm, RequestPasswordResetForm, ResetPasswordForm
+from app.modules.core.schemas.auth_schemas import Principal, Token, LoginForm, RequestPasswordResetForm, ResetPasswordForm
 from app.modules.core.schemas.user_schemas import UserCreate, UserResponse, UserUpdate
 from app.modules.core.services.user_service import UserService, get_user_service
 from app.modules.core.services.auth_service import AuthService, get_auth_service, has_permission
 from app.common.response import standard_response, StandardResponse
 from app.schemas import ValidationErrorSchema
-from app.common.rate_limiting import rate_limit
 
 
 router = APIRouter()
@@ -23,7 +21,6 @@ router = APIRouter()
     name="auth.register",
     tags=["Auth"]
 )
-@rate_limit(max_requests=6, window=60)
 async def register(
     request: Request,
     username: str = Form(...),
@@ -73,7 +70,6 @@ async def register(
     response_model=StandardResponse[Token],
     tags=["Auth"]
 )
-@rate_limit(max_requests=6, window=60)
 async def login(
     request: Request,
     form_data: LoginForm,
@@ -82,7 +78,7 @@ async def login(
     user = await auth_service.authenticate_user(form_data.username, form_data.password)
     if not user:
         return standard_response(401, "Incorrect username or password", None)
-    access_token = auth_service.create_access_token(user)
+    access_token = await auth_service.issue_access_token(user)
     token = Token(access_token=access_token, token_type="bearer")
     return standard_response(200, "Login successful", token)
 
@@ -94,10 +90,14 @@ async def login(
 )
 async def me(
     request: Request,
-    current_user: User = Depends(has_permission("base")),
+    current_user: Principal = Depends(has_permission("base")),
     user_service: UserService = Depends(get_user_service)
 ):
-    response_user = await user_service.get_user_response_from_user(current_user)
+    if current_user.from_claims:
+        response_user = user_service.get_user_response_from_principal(current_user)
+    else:
+        user = await user_service.get_first_by_field('id', current_user.id)
+        response_user = await user_service.get_user_response_from_user(user)
     return standard_response(200, None, response_user)
 
 
@@ -112,7 +112,7 @@ async def put_user(
     surname: str = Form(...),
     country_id: int = Form(...),
     photo: UploadFile = File(None),
-    current_user: User = Depends(has_permission("base")),
+    current_user: Principal = Depends(has_permission("base")),
     user_service: UserService = Depends(get_user_service)
 ):
     user_data = None
@@ -122,7 +122,7 @@ async def put_user(
             surname=surname,
             country_id=country_id,
             photo=photo,
-            role_ids=[role.id for role in current_user.roles]
+            role_ids=current_user.role_ids
         )
     except ValidationError as e:
         return standard_response(422, "Validation error", e.errors())
@@ -132,8 +132,9 @@ async def put_user(
     if validation_errors:
         return standard_response(422, "Validation error", validation_errors)
 
-    current_user = await user_service.update_user(current_user, user_data)
-    user_response = await user_service.get_user_response_from_user(current_user)
+    user = await user_service.get_first_by_field('id', current_user.id)
+    user = await user_service.update_user(user, user_data)
+    user_response = await user_service.get_user_response_from_user(user)
     return standard_response(200, None, user_response)
 
 
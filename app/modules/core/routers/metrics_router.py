@@ -0,0 +1,19 @@
+from fastapi import APIRouter, Depends
+from app.common.metrics import metrics
+from app.common.response import StandardResponse, standard_response
+from app.modules.core.schemas.auth_schemas import Principal
+from app.modules.core.services.auth_service import has_permission
+
+router = APIRouter()
+
+
+@router.get(
+    "/admin/metrics",
+    response_model=StandardResponse[dict],
+    name="metrics.get_metrics",
+    tags=["Metrics"]
+)
+async def get_metrics(
+    current_user: Principal = Depends(has_permission("admin"))
+):
+    return standard_response(200, None, metrics.snapshot())
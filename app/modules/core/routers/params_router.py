@@ -1,9 +1,11 @@
-from typing import Optional
-from fastapi import APIRouter, Depends
+from typing import List, Optional
+from fastapi import APIRouter, Depends, Query
 from app.common.response import StandardResponse, standard_response
 from app.modules.core.services.country_service import CountryService, get_country_service
 from app.modules.core.services.role_service import RoleService, get_role_service
 from app.modules.core.schemas.param_schemas import PublicParamsResponse
+from app.schemas import SuggestionResponse
+from config import settings
 
 router = APIRouter()
 
@@ -29,4 +31,18 @@ async def get_public_parameters(
         roles = await role_service.get_all()
         result.roles = [await role_service.get_role_response_from_role(role[0]) for role in roles]
 
-    return standard_response(200, None, result)
\ No newline at end of file
+    return standard_response(200, None, result)
+
+
+@router.get(
+    "/params/countries/suggest",
+    response_model=StandardResponse[List[SuggestionResponse]],
+    name="params.suggest_countries",
+    tags=["Params"]
+)
+async def suggest_countries(
+    q: str = Query(..., min_length=1, max_length=100, description='prefix of the country name'),
+    limit: int = Query(10, ge=1, le=settings.SUGGEST_MAX_LIMIT),
+    country_service: CountryService = Depends(get_country_service)
+):
+    return standard_response(200, None, await country_service.suggest(q, limit))
@@ -1,16 +1,35 @@
-from typing import List
+from typing import List, Literal, Optional
 from fastapi import APIRouter, Depends, Query, Request, UploadFile, Form, File
 from pydantic_core import ValidationError
-from app.modules.core.models.user import User
+from app.modules.core.schemas.auth_schemas import Principal
 from app.modules.core.schemas.user_schemas import UserCreate, UserResponse, UserUpdate, UserFilters
 from app.modules.core.services.user_service import UserService, get_user_service
 from app.modules.core.services.auth_service import has_permission
 from app.common.response import standard_response, StandardResponse
 from app.common.paginator import PaginatedResponse
+from app.schemas import SuggestionResponse
+from config import settings
 
 
 router = APIRouter()
 
+
+@router.get(
+    "/admin/users/suggest",
+    response_model=StandardResponse[List[SuggestionResponse]],
+    name="user.suggest_users",
+    tags=["Users"]
+)
+async def suggest_users(
+    request: Request,
+    q: str = Query(..., min_length=1, max_length=100, description='prefix of the full name or username'),
+    limit: int = Query(10, ge=1, le=settings.SUGGEST_MAX_LIMIT),
+    current_user: Principal = Depends(has_permission("admin")),
+    user_service: UserService = Depends(get_user_service)
+):
+    return standard_response(200, None, await user_service.suggest(q, limit))
+
+
 @router.get(
     "/admin/users/{user_id}",
     response_model=StandardResponse[UserResponse],
@@ -20,10 +39,16 @@ router = APIRouter()
 async def get_user(
     request: Request,
     user_id: int,
-    current_user: User = Depends(has_permission("admin")),
+    fields: Optional[str] = Query(None, description='comma separated fields to return, all by default'),
+    current_user: Principal = Depends(has_permission("admin")),
     user_service: UserService = Depends(get_user_service)
 ):
-    user = await user_service.get_first_by_field('id', user_id)
+    fields = user_service.parse_fields(fields)
+    user = await user_service.get_user(user_id, fields)
+    if not user:
+        return standard_response(404, "Not found", None)
+    if fields is not None:
+        return standard_response(200, None, await user_service.get_sparse_user_response_from_user(user, fields))
     user_response = await user_service.get_user_response_from_user(user)
     return standard_response(200, None, user_response)
 
@@ -42,7 +67,7 @@ async def put_user(
     country_id: int = Form(...),
     photo: UploadFile = File(None),
     role_ids: str = Form(...),
-    current_user: User = Depends(has_permission("admin")),
+    current_user: Principal = Depends(has_permission("admin")),
     user_service: UserService = Depends(get_user_service)
 ):
     user_data = None
@@ -85,7 +110,7 @@ async def post_user(
     country_id: int = Form(...),
     photo: UploadFile = File(None),
     role_ids: str = Form(...),
-    current_user: User = Depends(has_permission("admin")),
+    current_user: Principal = Depends(has_permission("admin")),
     user_service: UserService = Depends(get_user_service)
 ):
         user_data = None
@@ -117,17 +142,24 @@ async def post_user(
 @router.get(
     '/admin/users',
     response_model=PaginatedResponse[UserResponse],
+    name="user.get_users",
     tags=["Users"]
 )
 async def get_users(
     request: Request,
     page: int = Query(1, ge=1),
     per_page: int = Query(100, ge=0),
+    pagination: Literal['offset', 'cursor'] = Query('offset', description='cursor pagination cost does not grow with depth'),
+    cursor: Optional[str] = Query(None, description='opaque cursor from next_page/previous_page, implies cursor pagination'),
+    count: Literal['exact', 'cached', 'estimated', 'none'] = Query('exact', description='how the total count is computed'),
+    fields: Optional[str] = Query(None, description='comma separated fields to return, all by default'),
     user_filters: UserFilters = Depends(),
-    current_user: User = Depends(has_permission("admin")),
+    current_user: Principal = Depends(has_permission("admin")),
     user_service: UserService = Depends(get_user_service)
 ):
-    paginated_results = await user_service.get_filtered(user_filters, page, per_page)
+    keyset = pagination == 'cursor' or cursor is not None
+    paginated_results = await user_service.get_filtered(user_filters, page, per_page, keyset, cursor, count,
+                                                        user_service.parse_fields(fields))
     return standard_response(200, None, paginated_results)
 
 
@@ -140,7 +172,7 @@ async def get_users(
 async def delete_user(
     request: Request,
     user_id: int,
-    current_user: User = Depends(has_permission("admin")),
+    current_user: Principal = Depends(has_permission("admin")),
     user_service: UserService = Depends(get_user_service)
 ):
     if current_user.id == user_id:
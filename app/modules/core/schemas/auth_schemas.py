@@ -1,5 +1,8 @@
+from typing import List, Optional
 from pydantic import BaseModel, field_validator, constr
 
+from app.modules.core.schemas.country_schemas import CountryResponse
+from app.modules.core.schemas.user_schemas import RoleResponse
 from app.modules.core.schemas.schema_validators import check_passwords_match
 
 
@@ -23,3 +26,23 @@ class ResetPasswordForm(BaseModel):
     password_confirmation: constr(min_length=8, max_length=50)
 
     _password_confirmation = field_validator('password_confirmation')(check_passwords_match)
+
+
+class Principal(BaseModel):
+    id: int
+    username: str
+    email: str
+    active: bool
+    roles: List[RoleResponse]
+    permissions: List[str]
+
+    # profile, only set when the principal is built from a claims mode token
+    from_claims: bool = False
+    name: Optional[str] = None
+    surname: Optional[str] = None
+    country: Optional[CountryResponse] = None
+    photo: Optional[str] = None  # encrypted photo object name
+
+    @property
+    def role_ids(self) -> List[int]:
+        return [role.id for role in self.roles]
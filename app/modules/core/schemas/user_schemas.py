@@ -2,8 +2,9 @@ from typing import Dict, List, Optional, Tuple
 from pydantic import EmailStr, constr, field_validator, BaseModel as BaseSchema
 from fastapi import UploadFile, File
 from app.modules.core.schemas.country_schemas import CountryResponse
-from app.common.filtering import BaseFiltering, FilterConfig, enhanced_ilike, equals
+from app.common.filtering import BaseFiltering, FilterConfig, array_contains, enhanced_ilike, equals, normalized_like
 from app.modules.core.models.user import User
+from config import settings
 from app.modules.core.schemas.schema_validators import check_passwords_match, validate_photo, validate_photo_size
 
 
@@ -61,6 +62,8 @@ class UserFilters(BaseFiltering):
     roles__name: Optional[str] = None
 
     def filters_config(self) ->  Tuple[User, Dict[str, FilterConfig]]:
+        if settings.USER_SEARCH_READ_MODEL_ENABLED:
+            return self.read_model_filters_config()
         return User, {
             'full_name': FilterConfig(
                 model_fields=['name', 'surname'],
@@ -91,3 +94,46 @@ class UserFilters(BaseFiltering):
                 comparison=enhanced_ilike,
             )
         }
+
+    def read_model_filters_config(self) -> Tuple[User, Dict[str, FilterConfig]]:
+        # the same filters against the precomputed, indexed user_search row:
+        # a single join, whatever the filters
+        return User, {
+            'full_name': FilterConfig(
+                model_fields=['search.full_name'],
+                comparison=normalized_like,
+            ),
+            'email': FilterConfig(
+                model_fields=['search.email'],
+                comparison=normalized_like,
+            ),
+            'username': FilterConfig(
+                model_fields=['search.username'],
+                comparison=normalized_like,
+            ),
+            'country_id': FilterConfig(
+                model_fields=['country_id'],
+                comparison=equals,
+            ),
+            'country__name': FilterConfig(
+                model_fields=['search.country_name'],
+                comparison=normalized_like,
+            ),
+            'roles__id': FilterConfig(
+                model_fields=['search.role_ids'],
+                comparison=array_contains,
+            ),
+            'roles__name': FilterConfig(
+                model_fields=['search.role_names'],
+                comparison=normalized_like,
+            )
+        }
+
+    def sortable_fields(self) -> Dict[str, str]:
+        # backed by the ix_users_<field>_id indexes; keyset pages need NOT NULL columns
+        return {
+            'id': 'id',
+            'username': 'username',
+            'email': 'email',
+            'created_at': 'created_at',
+        }
@@ -1,15 +1,19 @@
 from datetime import datetime, timedelta
+from typing import Optional
 from fastapi import Depends, HTTPException, Request
 from fastapi.security import HTTPBearer
 from jose import ExpiredSignatureError, JWTError, jwt
 from sqlalchemy.ext.asyncio.session import AsyncSession
 from app.modules.core.models.user import User
 from app.modules.core.schemas.user_schemas import UserCreate
+from app.modules.core.schemas.auth_schemas import Principal
+from app.modules.core.schemas.country_schemas import CountryResponse
 from app.modules.core.services.user_service import UserService, get_user_service
 from app.modules.core.services.email_template_service import EmailTemplateService, get_email_template_service
 from app.modules.core.services.email_service import EmailService, get_email_service
+from app.modules.core.services.principal_cache import principal_cache, principal_from_user
 from app.common.db import get_db
-from app.common.security import encrypt, decrypt, verify_password
+from app.common.security import encrypt, decrypt, password_hasher
 from config import settings
 
 
@@ -62,8 +66,11 @@ class AuthService:
         return await self.user_service.activate_user(user)
 
     async def authenticate_user(self, username: str, password: str):
-        user = await self.user_service.get_first_by_field('username', username, relationships_to_load=['roles', 'roles.permissions'])
-        if not user or not verify_password(password, user.password_hash) or not user.active:
+        relationships_to_load = ['roles', 'roles.permissions']
+        if settings.JWT_CLAIMS_MODE:
+            relationships_to_load.append('country')
+        user = await self.user_service.get_first_by_field('username', username, relationships_to_load=relationships_to_load)
+        if not user or not await password_hasher.verify(password, user.password_hash) or not user.active:
             return None
         return user
 
@@ -87,8 +94,15 @@ class AuthService:
 
         return True
 
+    async def issue_access_token(self, user: User) -> str:
+        auth_version = user.auth_version if settings.JWT_CLAIMS_MODE else None
+        return self.create_access_token(user, auth_version)
+
     @classmethod
-    def create_access_token(cls, user: User) -> str:
+    def create_access_token(cls, user: User, auth_version: Optional[int] = None) -> str:
+        '''When an auth version is given (claims mode), the token also carries the user's
+        permissions and profile so that it can be trusted without a database lookup.
+        The user must have roles, roles.permissions and country loaded.'''
         token_life = settings.JWT_ACCESS_TOKEN_EXPIRE_DAYS
         expire = datetime.utcnow() + timedelta(days=token_life)
         to_encode = {
@@ -101,10 +115,18 @@ class AuthService:
             "active": user.active,
             "exp": expire,
         }
+        if auth_version is not None:
+            country = user.country
+            to_encode.update({
+                "perms": sorted({perm.name for role in user.roles for perm in role.permissions}),
+                "ver": auth_version,
+                "country": {"id": country.id, "code": country.code, "name": country.name} if country else None,
+                "photo": encrypt(user.photo_path) if user.photo_path else None,
+            })
         encoded_jwt = jwt.encode(to_encode, settings.SECRET_KEY, algorithm=cls.ALGORITHM)
         return encoded_jwt
 
-    async def get_current_user(self, token: str):
+    async def get_current_user(self, token: str) -> Principal:
         try:
             payload = jwt.decode(token, settings.SECRET_KEY, algorithms=[self.ALGORITHM])
             user_id: int = int(payload.get("sub"))
@@ -116,10 +138,43 @@ class AuthService:
         except JWTError as e:
             raise UnauthorizedException()
 
-        user = await self.user_service.get_first_by_field('id', user_id, relationships_to_load=['roles', 'roles.permissions'])
+        if settings.JWT_CLAIMS_MODE and "ver" in payload:
+            principal = await self.get_principal_from_claims(user_id, payload)
+            if principal is not None:
+                return principal
+
+        if settings.PRINCIPAL_CACHE_ENABLED:
+            principal = await principal_cache.get(user_id)
+            if principal is not None:
+                return principal
+
+        user = await self.user_service.get_user_for_authorization(user_id)
         if user is None:
             raise UnauthorizedException()
-        return user
+
+        principal = principal_from_user(user)
+        if settings.PRINCIPAL_CACHE_ENABLED:
+            await principal_cache.set(user_id, principal)
+        return principal
+
+    async def get_principal_from_claims(self, user_id: int, payload: dict) -> Optional[Principal]:
+        '''Trust the token claims as long as its auth version is still the current one.'''
+        if await self.user_service.get_auth_version(user_id) != payload["ver"]:
+            return None
+        country = payload.get("country")
+        return Principal(
+            id=user_id,
+            username=payload["username"],
+            email=payload["email"],
+            active=payload["active"],
+            roles=payload["role"],
+            permissions=payload["perms"],
+            from_claims=True,
+            name=payload["name"],
+            surname=payload["surname"],
+            country=CountryResponse(**country) if country else None,
+            photo=payload.get("photo"),
+        )
 
 
 def get_auth_service(request: Request, db: AsyncSession = Depends(get_db)) -> AuthService:
@@ -127,7 +182,7 @@ def get_auth_service(request: Request, db: AsyncSession = Depends(get_db)) -> Au
                        get_email_service()) 
 
 
-async def get_current_user(bearer_token = Depends(bearer_scheme), auth_service: AuthService = Depends(get_auth_service)):
+async def get_current_user(bearer_token = Depends(bearer_scheme), auth_service: AuthService = Depends(get_auth_service)) -> Principal:
     if not bearer_token or not bearer_token.credentials:
         raise UnauthorizedException()
     token = bearer_token.credentials
@@ -135,9 +190,8 @@ async def get_current_user(bearer_token = Depends(bearer_scheme), auth_service:
 
 
 def has_permission(required_permission: str):
-    async def permission_checker(current_user: User = Depends(get_current_user)) -> User:
-        user_permissions = {perm.name for role in current_user.roles for perm in role.permissions}
-        if not required_permission in user_permissions:
+    async def permission_checker(current_user: Principal = Depends(get_current_user)) -> Principal:
+        if not required_permission in current_user.permissions:
             raise UnauthorizedException()
         return current_user
     return permission_checker
@@ -0,0 +1,92 @@
+import logging
+from typing import Optional
+from redis.exceptions import RedisError
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.common.db import use_primary
+from app.common.redis import execute, get_redis
+from app.modules.core.models.user import User
+from config import settings
+
+
+# Per-user authorization version used by the JWT claims mode. Tokens carry the
+# version they were issued with; any change that could alter a user's claims
+# bumps it, so older tokens stop being trusted and fall back to the database.
+# The version lives in users.auth_version and Redis only caches it.
+
+# Caches a version unless a newer one, or the deleted marker, is cached already:
+# a read that loaded the version from the database before a bump committed must
+# not put it back once the bumped version was cached.
+CACHE_VERSION_SCRIPT = """
+local current = redis.call('GET', KEYS[1])
+if current and (current == ARGV[3] or tonumber(current) >= tonumber(ARGV[1])) then
+    return 0
+end
+redis.call('SET', KEYS[1], ARGV[1], 'EX', ARGV[2])
+return 1
+"""
+
+DELETED = "deleted"
+
+_cache_version_script = None
+
+
+def _key(user_id: int) -> str:
+    return f"auth_version:{user_id}"
+
+
+async def _cache(user_id: int, version: Optional[int]) -> None:
+    if version is None:
+        # the user is gone; the marker always wins over a version being cached
+        await execute(lambda redis: redis.set(_key(user_id), DELETED, ex=settings.AUTH_VERSION_CACHE_TTL))
+        return
+
+    global _cache_version_script
+    if _cache_version_script is None:
+        _cache_version_script = get_redis().register_script(CACHE_VERSION_SCRIPT)
+    await execute(lambda redis: _cache_version_script(
+        keys=[_key(user_id)], args=[version, settings.AUTH_VERSION_CACHE_TTL, DELETED], client=redis
+    ))
+
+
+async def _read(db: AsyncSession, user_id: int) -> Optional[int]:
+    with use_primary(db):
+        return await db.scalar(select(User.auth_version).where(User.id == user_id))
+
+
+def bump_auth_version(user: User) -> None:
+    '''Takes effect with the caller's commit, together with the change it covers.'''
+    user.auth_version = User.auth_version + 1
+
+
+async def get_auth_version(db: AsyncSession, user_id: int) -> Optional[int]:
+    '''The current version, or None if the user doesn't exist. Read from the
+    primary database whenever Redis doesn't have it or can't be reached.'''
+    cacheable = True
+    try:
+        version = await execute(lambda redis: redis.get(_key(user_id)))
+    except RedisError as e:
+        logging.warning(f"Could not read cached auth version for user {user_id}: {e}")
+        version, cacheable = None, False
+    if version is not None:
+        return None if version.decode() == DELETED else int(version)
+
+    version = await _read(db, user_id)
+    if version is not None and cacheable:
+        try:
+            await _cache(user_id, version)
+        except RedisError as e:
+            logging.warning(f"Could not cache auth version for user {user_id}: {e}")
+    return version
+
+
+async def invalidate_auth_version(db: AsyncSession, user_id: int) -> None:
+    '''Caches the version committed by a bump (or that the user was deleted),
+    so reads that loaded the previous one can no longer cache it.'''
+    try:
+        await _cache(user_id, await _read(db, user_id))
+    except RedisError as e:
+        logging.error(
+            f"Could not invalidate auth version for user {user_id}, old tokens stay trusted "
+            f"for up to {settings.AUTH_VERSION_CACHE_TTL}s: {e}"
+        )
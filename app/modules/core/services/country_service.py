@@ -1,8 +1,10 @@
+from typing import List
 from fastapi import Depends
 from sqlalchemy.ext.asyncio.session import AsyncSession
 from app.common.base_service import BaseService
 from app.modules.core.repositories.country_repository import CountryRepository
 from app.common.db import get_db
+from app.schemas import SuggestionResponse
 from app.modules.core.models.user import Country
 from app.modules.core.schemas.country_schemas import CountryResponse
 
@@ -12,6 +14,9 @@ class CountryService(BaseService):
         country_data = country.__dict__.copy()
         return CountryResponse.model_validate(country_data)
 
+    async def suggest(self, prefix: str, limit: int) -> List[SuggestionResponse]:
+        return [SuggestionResponse(id=id, name=name) for id, name in await self.repository.suggest(prefix, limit)]
+
 
 def get_country_service(db: AsyncSession = Depends(get_db)) -> CountryService:
     return CountryService(CountryRepository(db))
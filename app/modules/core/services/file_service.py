@@ -91,7 +91,9 @@ class FileService:
                 return False
 
     def get_url(self, object_name: str):
-        encrypted_object_name = encrypt(object_name)
+        return self.get_url_from_encrypted(encrypt(object_name))
+
+    def get_url_from_encrypted(self, encrypted_object_name: str):
         url = self.request.url_for('file.get_file', encrypted_object_name=encrypted_object_name)
         return str(url)
 
@@ -0,0 +1,30 @@
+from app.common.cache import TieredCache
+from app.modules.core.models.user import User
+from app.modules.core.schemas.auth_schemas import Principal
+from app.modules.core.schemas.user_schemas import RoleResponse
+from config import settings
+
+
+# Keyed by user id. Entries are invalidated by UserService whenever a user is
+# updated, activated, deleted or changes their password. With the Redis tier the
+# invalidation is published to every worker (see the app lifespan); without it
+# other workers' local copies may lag for at most PRINCIPAL_CACHE_TTL seconds.
+principal_cache: TieredCache[Principal] = TieredCache(
+    'principal',
+    Principal,
+    max_size=settings.PRINCIPAL_CACHE_MAX_SIZE,
+    local_ttl=settings.PRINCIPAL_CACHE_TTL,
+    redis_ttl=settings.PRINCIPAL_CACHE_REDIS_TTL,
+    use_redis=settings.PRINCIPAL_CACHE_REDIS_ENABLED,
+)
+
+
+def principal_from_user(user: User) -> Principal:
+    return Principal(
+        id=user.id,
+        username=user.username,
+        email=user.email,
+        active=user.active,
+        roles=[RoleResponse(id=role.id, name=role.name) for role in user.roles],
+        permissions=sorted({perm.name for role in user.roles for perm in role.permissions}),
+    )
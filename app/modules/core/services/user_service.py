@@ -1,5 +1,7 @@
-from typing import List
-from fastapi import Depends, Request
+from datetime import datetime, timedelta
+from typing import List, Optional
+from fastapi import Depends, HTTPException, Request, status
+from sqlalchemy import or_
 from sqlalchemy.ext.asyncio.session import AsyncSession
 from app.common.base_service import BaseService
 from app.modules.core.models.user import User
@@ -9,8 +11,12 @@ from app.modules.core.repositories.user_repository import UserRepository
 from app.modules.core.services.role_service import RoleService, get_role_service
 from app.modules.core.services.country_service import CountryService, get_country_service
 from app.modules.core.services.file_service import FileService, get_file_service
-from app.common.security import get_password_hash
-from app.common.db import get_db
+from app.modules.core.services.principal_cache import principal_cache
+from app.modules.core.services.auth_version import bump_auth_version, get_auth_version, invalidate_auth_version
+from app.modules.core.schemas.auth_schemas import Principal
+from app.common.security import password_hasher
+from app.common.db import get_db, use_primary
+from app.schemas import SuggestionResponse
 from config import settings
 
 
@@ -34,10 +40,20 @@ class UserService(BaseService):
             if user_data.photo:
                 photo_path = await self.file_service.save_file(user_data.photo, settings.UPLOADS_DIR)
 
+            password_hash = await password_hasher.hash(user_data.password)
+
             transaction = await self.repository.db.begin_nested()
+
+            # inactive accounts past the activation timeout don't reserve their
+            # email/username (see UserIntegrityValidator), free them up
+            reserved_since = datetime.utcnow() - timedelta(seconds=settings.ACCOUNT_ACTIVATION_TIMEOUT)
+            await self.repository.delete_stale_users(
+                reserved_since, or_(User.email == user_data.email, User.username == user_data.username)
+            )
+
             new_user = User(
                 username=user_data.username,
-                password_hash=get_password_hash(user_data.password),
+                password_hash=password_hash,
                 name=user_data.name,
                 surname=user_data.surname,
                 email=user_data.email,
@@ -52,9 +68,7 @@ class UserService(BaseService):
             # add roles
             await self.repository.ensure_relationships_loaded(new_user, ["roles"])
             if user_data.role_ids:
-                for role_id in user_data.role_ids:
-                    role = await self.role_service.get_first_by_field('id', role_id)
-                    new_user.roles.append(role)
+                new_user.roles.extend(await self.role_service.get_by_ids(user_data.role_ids))
             else:
                 # Assign default role
                 role = await self.role_service.get_first_by_field('name', 'user')
@@ -73,8 +87,10 @@ class UserService(BaseService):
             raise e
 
     async def update_user_password(self, user: User, password: str) -> User:
-        user.password_hash = get_password_hash(password)
+        user.password_hash = await password_hasher.hash(password)
+        bump_auth_version(user)
         await self.repository.commit()
+        await self.invalidate_authorization(user.id)
 
     async def update_user(self, user: User, user_data: UserUpdate) -> User:
         await self.repository.ensure_relationships_loaded(user, ["roles"])
@@ -84,10 +100,7 @@ class UserService(BaseService):
         user.country_id = user_data.country_id
         current_role_ids = [role.id for role in user.roles]
         if sorted(user_data.role_ids) != sorted(current_role_ids):
-            user.roles = []
-            for role_id in user_data.role_ids:
-                role = await self.role_service.get_first_by_field('id', role_id)
-                user.roles.append(role)
+            user.roles = await self.role_service.get_by_ids(user_data.role_ids)
 
         if user.photo_path:
             try:
@@ -100,16 +113,65 @@ class UserService(BaseService):
         else:
             user.photo_path = None
 
+        bump_auth_version(user)
         await self.repository.commit()
+        await self.invalidate_authorization(user.id)
         return await self.repository.refresh(user)
 
     async def activate_user(self, user: User) -> User:
         if not user.active:
             user.active = True
+            bump_auth_version(user)
             await self.repository.commit()
+            await self.invalidate_authorization(user.id)
             return True
         return False
 
+    def get_user_response_from_principal(self, principal: Principal) -> UserResponse:
+        return UserResponse(
+            id=principal.id,
+            username=principal.username,
+            name=principal.name,
+            surname=principal.surname,
+            email=principal.email,
+            country=principal.country,
+            roles=principal.roles,
+            photo_url=self.file_service.get_url_from_encrypted(principal.photo) if principal.photo else None,
+        )
+
+    def parse_fields(self, fields: Optional[str]) -> Optional[List[str]]:
+        '''`fields=id,username,email` as a list of UserResponse fields, in
+        response order and always with the id; None (every field) if empty.'''
+        if not fields:
+            return None
+        requested = {field.strip() for field in fields.split(',') if field.strip()}
+        unknown = requested - set(UserResponse.model_fields)
+        if unknown:
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
+                                detail=f"Unknown fields: {', '.join(sorted(unknown))}")
+        return [field for field in UserResponse.model_fields if field in requested or field == 'id']
+
+    async def get_user(self, user_id: int, fields: Optional[List[str]] = None) -> Optional[User]:
+        users = await self.repository.get_by_ids([user_id], load_options=self.repository.response_load_options(fields))
+        return users[0] if users else None
+
+    async def get_sparse_user_response_from_user(self, user: User, fields: List[str]) -> dict:
+        '''Only `fields` of the UserResponse, touching nothing else on `user`
+        (it may have been loaded with just those, see response_load_options).'''
+        user_data = {}
+        for field in fields:
+            if field == 'country':
+                country = user.country
+                user_data['country'] = (await self.country_service.get_country_response_from_country(country)).model_dump() \
+                    if country else None
+            elif field == 'roles':
+                user_data['roles'] = [(await self.role_service.get_role_response_from_role(role)).model_dump() for role in user.roles]
+            elif field == 'photo_url':
+                user_data['photo_url'] = self.file_service.get_url(user.photo_path) if user.photo_path else None
+            else:
+                user_data[field] = getattr(user, field)
+        return user_data
+
     async def get_user_response_from_user(self, user: User) -> UserResponse:
         await self.repository.ensure_relationships_loaded(user, ["country", "roles"])
         user_data = user.__dict__.copy()
@@ -119,22 +181,48 @@ class UserService(BaseService):
             user_data["photo_url"] = self.file_service.get_url(user.photo_path)
         return UserResponse.model_validate(user_data)
 
-    async def get_filtered(self, user_filters: UserFilters, page: int, per_page: int) -> List[UserResponse]:
+    async def get_filtered(self, user_filters: UserFilters, page: int, per_page: int, keyset: bool = False,
+                           cursor: Optional[str] = None, count_strategy: str = 'exact',
+                           fields: Optional[List[str]] = None) -> List[UserResponse]:
         query = user_filters.apply_filters()
-        users = await self.repository.paginate(query, page, per_page)
-        users['items'] = [await self.get_user_response_from_user(user) for user in users['items']]
+        users = await self.repository.paginate(query, page, per_page, keyset, cursor, count_strategy,
+                                               self.repository.response_load_options(fields), user_filters.get_sort())
+        if fields is None:
+            users['items'] = [await self.get_user_response_from_user(user) for user in users['items']]
+        else:
+            users['items'] = [await self.get_sparse_user_response_from_user(user, fields) for user in users['items']]
         return users
 
+    async def suggest(self, prefix: str, limit: int) -> List[SuggestionResponse]:
+        return [SuggestionResponse(id=id, name=name) for id, name in await self.repository.suggest(prefix, limit)]
+
     async def delete_user(self, user: User) -> bool:
         if user.photo_path:
             try:
                 await self.file_service.delete_file(user.photo_path)
             except:
                 pass
+        user_id = user.id
         await self.repository.delete(user)
         await self.repository.commit()
+        await self.invalidate_authorization(user_id)
         return True
 
+    async def get_user_for_authorization(self, user_id: int) -> Optional[User]:
+        '''Always read from the primary: a lagging replica could still return
+        roles or an active flag that were just revoked.'''
+        with use_primary(self.repository.db):
+            return await self.get_first_by_field('id', user_id, relationships_to_load=['roles', 'roles.permissions'])
+
+    async def get_auth_version(self, user_id: int) -> Optional[int]:
+        return await get_auth_version(self.repository.db, user_id)
+
+    async def invalidate_authorization(self, user_id: int) -> None:
+        '''Runs after the commit; the auth version was bumped (or the user deleted) in it.'''
+        await principal_cache.delete(user_id)
+        if settings.JWT_CLAIMS_MODE:
+            await invalidate_auth_version(self.repository.db, user_id)
+
 
 def get_user_service(request: Request, db: AsyncSession = Depends(get_db)) -> UserService:
     user_repository = UserRepository(db)
@@ -146,5 +234,5 @@ def get_user_service(request: Request, db: AsyncSession = Depends(get_db)) -> Us
         role_service,
         country_service,
         get_file_service(request),
-        UserIntegrityValidator(user_repository, role_service, country_service)
+        UserIntegrityValidator(user_repository)
     )
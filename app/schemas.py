@@ -16,3 +16,8 @@ class StandardResponse(BaseModel, Generic[T]):
     status: int
     message: Optional[str] = None
     result: Optional[T] = None
+
+
+class SuggestionResponse(BaseModel):
+    id: int
+    name: Optional[str] = None
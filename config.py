@@ -1,4 +1,5 @@
 import os
+from typing import Dict, List, Optional, Tuple
 from pydantic_settings import BaseSettings
 from dotenv import find_dotenv, load_dotenv
 
@@ -6,6 +7,11 @@ from dotenv import find_dotenv, load_dotenv
 class CommonSettings(BaseSettings):
     ACCOUNT_ACTIVATION_TIMEOUT: int = 86400  # 24 hours
     JWT_ACCESS_TOKEN_EXPIRE_DAYS: int = 30
+    # trust permissions embedded in access tokens, checked against users.auth_version
+    JWT_CLAIMS_MODE: bool = False
+    # seconds the auth version is cached in Redis; bounds how long a token stays
+    # trusted after its revocation if the cache could not be invalidated
+    AUTH_VERSION_CACHE_TTL: int = 60
     SERVER_URL: str
     SECRET_KEY: str
     FASTAPI_RUN_PORT: int
@@ -17,6 +23,30 @@ class CommonSettings(BaseSettings):
     POSTGRES_PASSWORD: str
     POSTGRES_DB: str
 
+    DB_POOL_SIZE: int = 10
+    DB_POOL_MIN_SIZE: int = 2  # connections opened at startup
+    DB_MAX_OVERFLOW: int = 10
+    DB_POOL_TIMEOUT: float = 30  # seconds waiting for a connection
+    DB_POOL_RECYCLE: int = 1800  # seconds
+    DB_POOL_PRE_PING: bool = True
+    DB_PREPARED_STATEMENT_CACHE_SIZE: int = 100
+    # connect through a transaction pooler (PgBouncer): no prepared statement
+    # caching and no app-side pool, the DB_POOL_* settings above are ignored
+    DB_PGBOUNCER_MODE: bool = False
+
+    # comma separated host:port list of read replicas (same credentials and database)
+    POSTGRES_REPLICA_HOSTS: str = ""
+    # after a write, a client's reads stay on the primary for this many seconds
+    DB_REPLICA_PIN_SECONDS: int = 5
+
+    PAGINATION_COUNT_CACHE_TTL: int = 30  # seconds, for count=cached
+
+    # search users through the trigger-maintained user_search read model
+    USER_SEARCH_READ_MODEL_ENABLED: bool = False
+    # largest limit= of the /suggest endpoints; they serve typeahead at keystroke
+    # rate, so pages are small and fixed, without a count
+    SUGGEST_MAX_LIMIT: int = 20
+
     MAIL_SERVER: str
     MAIL_PORT: int
     MAIL_USERNAME: str
@@ -25,8 +55,37 @@ class CommonSettings(BaseSettings):
     MAIL_USE_SSL: bool
     MAIL_FROM_EMAIL: str
 
+    # bcrypt runs on a bounded thread pool, see app/common/security.PasswordHasher
+    PASSWORD_HASHING_MAX_CONCURRENCY: int = 4
+    PASSWORD_HASHING_QUEUE_TIMEOUT: float = 5.0  # seconds, then 503
+
     CORS_ORIGINS: str
     REDIS_HOST: str
+    REDIS_MAX_CONNECTIONS: int = 50
+    REDIS_SOCKET_TIMEOUT: float = 0.5  # seconds
+    REDIS_SOCKET_CONNECT_TIMEOUT: float = 0.5  # seconds
+    # consecutive connection errors/timeouts before Redis calls are skipped
+    REDIS_BREAKER_FAILURE_THRESHOLD: int = 5
+    REDIS_BREAKER_RESET_TIMEOUT: float = 30  # seconds before retrying Redis
+
+    RATE_LIMIT_BACKEND: str = "redis"  # redis, hybrid or memory
+    RATE_LIMIT_LEASE_FRACTION: float = 0.1  # hybrid: share of the limit leased per Redis call
+    RATE_LIMIT_FAILURE_MODE: str = "local"  # without Redis: "local" per-worker limits or "open"
+    # "METHOD /route/template": (max_requests, window in seconds)
+    RATE_LIMIT_POLICIES: Dict[str, Tuple[int, int]] = {
+        "POST /api/v1/auth/register": (6, 60),
+        "POST /api/v1/auth/login": (6, 60),
+    }
+
+    # authenticated principal cache (see app/modules/core/services/principal_cache.py)
+    PRINCIPAL_CACHE_ENABLED: bool = True
+    PRINCIPAL_CACHE_MAX_SIZE: int = 10000
+    # seconds, per worker. Invalidations reach other workers through Redis pub/sub
+    # when PRINCIPAL_CACHE_REDIS_ENABLED; otherwise their copies of a changed user
+    # (roles, active flag, password) stay valid for up to this long.
+    PRINCIPAL_CACHE_TTL: int = 30
+    PRINCIPAL_CACHE_REDIS_ENABLED: bool = False
+    PRINCIPAL_CACHE_REDIS_TTL: int = 300  # seconds, shared between workers
 
     AWS_ACCESS_KEY_ID: str
     AWS_SECRET_ACCESS_KEY: str
@@ -37,6 +96,8 @@ class CommonSettings(BaseSettings):
 
 class DevelopmentConfig(CommonSettings):
     DEBUG: bool = True
+    DB_POOL_SIZE: int = 5
+    DB_POOL_MIN_SIZE: int = 0
     LOG_FILE: str = "storage/logs/development.log"
     UPLOADS_DIR: str = "uploads"
 
@@ -44,9 +105,16 @@ class DevelopmentConfig(CommonSettings):
     def sqlalchemy_database_url(self) -> str:
         return f"postgresql+asyncpg://{self.POSTGRES_USER}:{self.POSTGRES_PASSWORD}@{self.POSTGRES_HOST}:{self.POSTGRES_PORT}/{self.POSTGRES_DB}"
 
+    @property
+    def sqlalchemy_replica_database_urls(self) -> List[str]:
+        hosts = [host.strip() for host in self.POSTGRES_REPLICA_HOSTS.split(',') if host.strip()]
+        return [f"postgresql+asyncpg://{self.POSTGRES_USER}:{self.POSTGRES_PASSWORD}@{host}/{self.POSTGRES_DB}" for host in hosts]
+
 
 class ProductionConfig(CommonSettings):
     DEBUG: bool = False
+    DB_POOL_SIZE: int = 20
+    DB_POOL_MIN_SIZE: int = 5
     LOG_FILE: str = "storage/logs/production.log"
     UPLOADS_DIR: str = "uploads"
 
@@ -54,12 +122,19 @@ class ProductionConfig(CommonSettings):
     def sqlalchemy_database_url(self) -> str:
         return f"postgresql+asyncpg://{self.POSTGRES_USER}:{self.POSTGRES_PASSWORD}@{self.POSTGRES_HOST}:{self.POSTGRES_PORT}/{self.POSTGRES_DB}"
 
+    @property
+    def sqlalchemy_replica_database_urls(self) -> List[str]:
+        hosts = [host.strip() for host in self.POSTGRES_REPLICA_HOSTS.split(',') if host.strip()]
+        return [f"postgresql+asyncpg://{self.POSTGRES_USER}:{self.POSTGRES_PASSWORD}@{host}/{self.POSTGRES_DB}" for host in hosts]
+
 
 class TestingConfig(CommonSettings):
     TESTING: bool = True
     DEBUG: bool = True
+    DB_POOL_MIN_SIZE: int = 0
     LOG_FILE: str = "tests/storage/logs/testing.log"
     UPLOADS_DIR: str = "tests/uploads"
+    RATE_LIMIT_BACKEND: str = "memory"
 
     POSTGRES_TEST_HOST: str
     POSTGRES_TEST_PORT: str
@@ -67,10 +142,18 @@ class TestingConfig(CommonSettings):
     POSTGRES_TEST_PASSWORD: str
     POSTGRES_TEST_DB: str
 
+    # optional PgBouncer (transaction mode) in front of the test database
+    POSTGRES_TEST_PGBOUNCER_HOST: Optional[str] = None
+    POSTGRES_TEST_PGBOUNCER_PORT: str = "5432"
+
     @property
     def sqlalchemy_test_database_url(self) -> str:
         return f"postgresql+asyncpg://{self.POSTGRES_TEST_USER}:{self.POSTGRES_TEST_PASSWORD}@{self.POSTGRES_TEST_HOST}:{self.POSTGRES_TEST_PORT}/{self.POSTGRES_TEST_DB}"
 
+    @property
+    def sqlalchemy_test_pgbouncer_url(self) -> str:
+        return f"postgresql+asyncpg://{self.POSTGRES_TEST_USER}:{self.POSTGRES_TEST_PASSWORD}@{self.POSTGRES_TEST_PGBOUNCER_HOST}:{self.POSTGRES_TEST_PGBOUNCER_PORT}/{self.POSTGRES_TEST_DB}"
+
 
 def get_settings(env) -> BaseSettings:
     if env == "production":
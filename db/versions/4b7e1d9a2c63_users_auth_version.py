@@ -0,0 +1,26 @@
+"""users auth version
+
+Revision ID: 4b7e1d9a2c63
+Revises: d8b25e6f0c14
+Create Date: 2026-10-18 18:02:41.318204
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '4b7e1d9a2c63'
+down_revision = 'd8b25e6f0c14'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # tokens issued with a version only Redis knew about are no longer trusted
+    # and fall back to the database until they are reissued
+    op.add_column('users', sa.Column('auth_version', sa.Integer(), server_default='0', nullable=False))
+
+
+def downgrade():
+    op.drop_column('users', 'auth_version')
@@ -0,0 +1,50 @@
+"""search indexes
+
+Revision ID: 5c9e2a7d41b8
+Revises: 03f38e636f9f
+Create Date: 2026-10-18 10:12:31.204518
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = '5c9e2a7d41b8'
+down_revision = '03f38e636f9f'
+branch_labels = None
+depends_on = None
+
+
+# must stay identical to app.common.filtering.search_expression, otherwise the
+# planner won't match the filters to these indexes
+SEARCH_INDEXES = {
+    'ix_users_full_name_search': ('users', "lower(immutable_unaccent((coalesce(name, '') || ' ') || coalesce(surname, '')))"),
+    'ix_users_username_search': ('users', "lower(immutable_unaccent(username))"),
+    'ix_users_email_search': ('users', "lower(immutable_unaccent(email))"),
+    'ix_countries_name_search': ('countries', "lower(immutable_unaccent(name))"),
+    'ix_roles_name_search': ('roles', "lower(immutable_unaccent(name))"),
+}
+
+
+def upgrade():
+    op.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm;")
+
+    # unaccent is only STABLE (it depends on search_path), so it can't be used in
+    # an index; this wrapper pins the dictionary and is IMMUTABLE
+    op.execute(
+        "CREATE OR REPLACE FUNCTION immutable_unaccent(text) RETURNS text "
+        "LANGUAGE sql IMMUTABLE PARALLEL SAFE STRICT "
+        "AS $$ SELECT public.unaccent('public.unaccent'::regdictionary, $1) $$;"
+    )
+
+    for name, (table, expression) in SEARCH_INDEXES.items():
+        op.execute(f"CREATE INDEX {name} ON {table} USING gin ({expression} gin_trgm_ops);")
+
+
+def downgrade():
+    for name in SEARCH_INDEXES:
+        op.execute(f"DROP INDEX IF EXISTS {name};")
+
+    op.execute("DROP FUNCTION IF EXISTS immutable_unaccent(text);")
+    # pg_trgm stays: it may have existed before this migration and other
+    # objects may depend on it
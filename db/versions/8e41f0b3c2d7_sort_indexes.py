@@ -0,0 +1,33 @@
+"""sort indexes
+
+Revision ID: 8e41f0b3c2d7
+Revises: 5c9e2a7d41b8
+Create Date: 2026-10-18 12:40:05.913822
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = '8e41f0b3c2d7'
+down_revision = '5c9e2a7d41b8'
+branch_labels = None
+depends_on = None
+
+
+# one per UserFilters.sortable_fields entry, id being the paginators' tiebreaker
+SORT_INDEXES = {
+    'ix_users_username_id': ['username', 'id'],
+    'ix_users_email_id': ['email', 'id'],
+    'ix_users_created_at_id': ['created_at', 'id'],
+}
+
+
+def upgrade():
+    for name, columns in SORT_INDEXES.items():
+        op.create_index(name, 'users', columns)
+
+
+def downgrade():
+    for name in SORT_INDEXES:
+        op.drop_index(name, table_name='users')
@@ -0,0 +1,146 @@
+"""user search read model
+
+Revision ID: a3f7c19e5b20
+Revises: 8e41f0b3c2d7
+Create Date: 2026-10-18 15:02:47.388104
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision = 'a3f7c19e5b20'
+down_revision = '8e41f0b3c2d7'
+branch_labels = None
+depends_on = None
+
+
+# same as app.modules.core.models.user.USER_SEARCH_DDL at the time of writing
+USER_SEARCH_DDL = [
+    """
+    CREATE OR REPLACE FUNCTION refresh_user_search(user_ids integer[]) RETURNS void LANGUAGE sql AS $$
+        -- serializes refreshes of a user: under READ COMMITTED two transactions
+        -- changing its roles would otherwise each aggregate without the other's
+        -- change, and the last upsert would lose one. The INSERT below takes a
+        -- new snapshot, after the lock. NO KEY UPDATE doesn't conflict with the
+        -- KEY SHARE locks taken by foreign key checks on users_roles.
+        SELECT 1 FROM users WHERE id = ANY(user_ids) ORDER BY id FOR NO KEY UPDATE;
+        INSERT INTO user_search (user_id, full_name, username, email, country_name, role_ids, role_names)
+        SELECT users.id,
+               lower(immutable_unaccent(coalesce(users.name, '') || ' ' || coalesce(users.surname, ''))),
+               lower(immutable_unaccent(users.username)),
+               lower(immutable_unaccent(users.email)),
+               lower(immutable_unaccent(countries.name)),
+               coalesce(array_agg(roles.id ORDER BY roles.id) FILTER (WHERE roles.id IS NOT NULL), '{}'),
+               coalesce(string_agg(lower(immutable_unaccent(roles.name)), chr(10) ORDER BY roles.id), '')
+        FROM users
+        LEFT JOIN countries ON countries.id = users.country_id
+        LEFT JOIN users_roles ON users_roles.user_id = users.id
+        LEFT JOIN roles ON roles.id = users_roles.role_id
+        WHERE users.id = ANY(user_ids)
+        GROUP BY users.id, countries.name
+        ON CONFLICT (user_id) DO UPDATE SET
+            full_name = EXCLUDED.full_name,
+            username = EXCLUDED.username,
+            email = EXCLUDED.email,
+            country_name = EXCLUDED.country_name,
+            role_ids = EXCLUDED.role_ids,
+            role_names = EXCLUDED.role_names
+    $$
+    """,
+    """
+    CREATE OR REPLACE FUNCTION user_search_on_users() RETURNS trigger LANGUAGE plpgsql AS $$
+    BEGIN
+        PERFORM refresh_user_search(ARRAY[NEW.id]);
+        RETURN NULL;
+    END
+    $$
+    """,
+    """
+    CREATE TRIGGER user_search_on_users AFTER INSERT OR UPDATE OF name, surname, username, email, country_id
+    ON users FOR EACH ROW EXECUTE FUNCTION user_search_on_users()
+    """,
+    """
+    CREATE OR REPLACE FUNCTION user_search_on_users_roles() RETURNS trigger LANGUAGE plpgsql AS $$
+    BEGIN
+        IF TG_OP IN ('INSERT', 'UPDATE') THEN
+            PERFORM refresh_user_search(ARRAY[NEW.user_id]);
+        END IF;
+        IF TG_OP IN ('DELETE', 'UPDATE') THEN
+            PERFORM refresh_user_search(ARRAY[OLD.user_id]);
+        END IF;
+        RETURN NULL;
+    END
+    $$
+    """,
+    """
+    CREATE TRIGGER user_search_on_users_roles AFTER INSERT OR UPDATE OR DELETE
+    ON users_roles FOR EACH ROW EXECUTE FUNCTION user_search_on_users_roles()
+    """,
+    """
+    CREATE OR REPLACE FUNCTION user_search_on_countries() RETURNS trigger LANGUAGE plpgsql AS $$
+    BEGIN
+        PERFORM refresh_user_search(ARRAY(SELECT id FROM users WHERE country_id = NEW.id));
+        RETURN NULL;
+    END
+    $$
+    """,
+    """
+    CREATE TRIGGER user_search_on_countries AFTER UPDATE OF name
+    ON countries FOR EACH ROW EXECUTE FUNCTION user_search_on_countries()
+    """,
+    """
+    CREATE OR REPLACE FUNCTION user_search_on_roles() RETURNS trigger LANGUAGE plpgsql AS $$
+    BEGIN
+        PERFORM refresh_user_search(ARRAY(SELECT user_id FROM users_roles WHERE role_id = NEW.id));
+        RETURN NULL;
+    END
+    $$
+    """,
+    """
+    CREATE TRIGGER user_search_on_roles AFTER UPDATE OF name
+    ON roles FOR EACH ROW EXECUTE FUNCTION user_search_on_roles()
+    """,
+]
+
+TRIGGERS = {
+    'user_search_on_users': 'users',
+    'user_search_on_users_roles': 'users_roles',
+    'user_search_on_countries': 'countries',
+    'user_search_on_roles': 'roles',
+}
+
+
+def upgrade():
+    op.create_table('user_search',
+    sa.Column('user_id', sa.Integer(), nullable=False),
+    sa.Column('full_name', sa.Text(), nullable=False),
+    sa.Column('username', sa.Text(), nullable=True),
+    sa.Column('email', sa.Text(), nullable=True),
+    sa.Column('country_name', sa.Text(), nullable=True),
+    sa.Column('role_ids', postgresql.ARRAY(sa.Integer()), nullable=False),
+    sa.Column('role_names', sa.Text(), nullable=False),
+    sa.ForeignKeyConstraint(['user_id'], ['users.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('user_id')
+    )
+    for column in ('full_name', 'username', 'email', 'country_name', 'role_names'):
+        op.create_index(f'ix_user_search_{column}', 'user_search', [column],
+                        postgresql_using='gin', postgresql_ops={column: 'gin_trgm_ops'})
+    op.create_index('ix_user_search_role_ids', 'user_search', ['role_ids'], postgresql_using='gin')
+
+    for statement in USER_SEARCH_DDL:
+        op.execute(statement)
+
+    # backfill
+    op.execute("SELECT refresh_user_search(ARRAY(SELECT id FROM users));")
+
+
+def downgrade():
+    for trigger, table in TRIGGERS.items():
+        op.execute(f"DROP TRIGGER IF EXISTS {trigger} ON {table};")
+        op.execute(f"DROP FUNCTION IF EXISTS {trigger}();")
+    op.execute("DROP FUNCTION IF EXISTS refresh_user_search(integer[]);")
+
+    op.drop_table('user_search')
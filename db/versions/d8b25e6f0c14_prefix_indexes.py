@@ -0,0 +1,34 @@
+"""prefix indexes
+
+Revision ID: d8b25e6f0c14
+Revises: a3f7c19e5b20
+Create Date: 2026-10-18 16:21:09.551637
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = 'd8b25e6f0c14'
+down_revision = 'a3f7c19e5b20'
+branch_labels = None
+depends_on = None
+
+
+# the search expressions of the "search indexes" migration, in byte order
+# (COLLATE "C") so prefixes are index ranges; used by the suggest endpoints
+PREFIX_INDEXES = {
+    'ix_users_full_name_prefix': ('users', "lower(immutable_unaccent((coalesce(name, '') || ' ') || coalesce(surname, '')))"),
+    'ix_users_username_prefix': ('users', "lower(immutable_unaccent(username))"),
+    'ix_countries_name_prefix': ('countries', "lower(immutable_unaccent(name))"),
+}
+
+
+def upgrade():
+    for name, (table, expression) in PREFIX_INDEXES.items():
+        op.execute(f'CREATE INDEX {name} ON {table} (({expression}) COLLATE "C");')
+
+
+def downgrade():
+    for name in PREFIX_INDEXES:
+        op.execute(f"DROP INDEX IF EXISTS {name};")
@@ -1,10 +1,11 @@
 import logging
 import os
-from typing import AsyncIterator
+from contextlib import contextmanager
+from typing import AsyncIterator, List
 import pytest
 from unittest.mock import AsyncMock, patch
 from httpx import AsyncClient
-from sqlalchemy import NullPool, insert
+from sqlalchemy import NullPool, event, insert
 from sqlalchemy.ext.asyncio.session import AsyncSession
 from sqlalchemy.orm import sessionmaker
 from sqlalchemy.ext.asyncio import create_async_engine
@@ -128,3 +129,17 @@ async def current_transaction(async_engine, app, setup_db):
 
 def get_access_token(user: User):
     return AuthService.create_access_token(user)
+
+
+@contextmanager
+def count_queries(async_engine):
+    statements: List[str] = []
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    event.listen(async_engine.sync_engine, "before_cursor_execute", before_cursor_execute)
+    try:
+        yield statements
+    finally:
+        event.remove(async_engine.sync_engine, "before_cursor_execute", before_cursor_execute)
@@ -149,4 +149,13 @@ async def test_register_validation_error(app, test_client, current_transaction):
                 },
             ]
         }
-    }
\ No newline at end of file
+    }
+
+@pytest.mark.asyncio
+async def test_login_rate_limit_headers(app, test_client, current_transaction):
+    response = await test_client.post('/api/v1/auth/login', json={'username': 'nobody', 'password': 'wrongpassword'})
+
+    assert response.status_code == 401
+    assert response.headers['X-RateLimit-Limit'] == '6'
+    assert int(response.headers['X-RateLimit-Remaining']) < 6
+    assert 'X-RateLimit-Reset' in response.headers
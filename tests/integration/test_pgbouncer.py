@@ -0,0 +1,29 @@
+import asyncio
+import pytest
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio.session import AsyncSession
+from config import settings
+from app.common.db import create_engine
+from app.modules.core.models.user import Country
+from tests.conftest import DEFAULT_COUNTRIES
+
+
+@pytest.mark.asyncio
+@pytest.mark.skipif(not settings.POSTGRES_TEST_PGBOUNCER_HOST, reason="No PgBouncer configured for testing")
+async def test_pgbouncer_transaction_pooling():
+    # the bouncer has a much smaller server pool than there are concurrent sessions,
+    # so consecutive transactions of a session land on different server connections
+    engine = create_engine(settings.sqlalchemy_test_pgbouncer_url, pgbouncer=True)
+
+    async def run_transactions():
+        async with AsyncSession(engine) as session:
+            for i in range(20):
+                country_id = i % len(DEFAULT_COUNTRIES) + 1
+                country = await session.scalar(select(Country).where(Country.id == country_id))
+                assert country.name == DEFAULT_COUNTRIES[country_id - 1]['name']
+                await session.commit()
+
+    try:
+        await asyncio.gather(*[run_transactions() for _ in range(20)])
+    finally:
+        await engine.dispose()
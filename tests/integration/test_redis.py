@@ -0,0 +1,142 @@
+import asyncio
+import pytest
+from unittest import mock
+from redis.exceptions import ConnectionError, ResponseError
+from app.common import redis as app_redis
+from app.common.circuit_breaker import CircuitBreaker
+from app.common.rate_limiting import MemoryRateLimitBackend, RedisRateLimitBackend
+from app.common.redis import CircuitOpenError, execute
+
+
+@pytest.fixture
+def clock():
+    # the breaker's clock only; the event loop keeps the real one
+    with mock.patch('app.common.circuit_breaker.time') as breaker_time:
+        breaker_time.monotonic.return_value = 1000.0
+        yield breaker_time.monotonic
+
+
+@pytest.fixture
+def breaker(clock):
+    breaker = CircuitBreaker('test', failure_threshold=2, reset_timeout=30)
+    with mock.patch.object(app_redis, 'redis_breaker', breaker):
+        yield breaker
+
+
+async def fail(redis):
+    raise ConnectionError('Redis is down')
+
+
+async def succeed(redis):
+    return 'PONG'
+
+
+def test_circuit_breaker_cycle(clock):
+    breaker = CircuitBreaker('test', failure_threshold=2, reset_timeout=30)
+    assert breaker.allow()
+
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.CLOSED
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.OPEN
+    assert not breaker.allow()
+
+    # after the reset timeout a single trial is let through
+    clock.return_value += 30
+    assert breaker.allow()
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+    assert not breaker.allow()
+
+    # a failed trial opens it again
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.OPEN
+    assert not breaker.allow()
+
+    # a successful one closes it
+    clock.return_value += 30
+    assert breaker.allow()
+    breaker.record_success()
+    assert breaker.state == CircuitBreaker.CLOSED
+    assert breaker.failures == 0
+    assert breaker.allow()
+
+
+def test_circuit_breaker_trial_without_outcome(clock):
+    breaker = CircuitBreaker('test', failure_threshold=1, reset_timeout=30)
+    breaker.record_failure()
+    clock.return_value += 30
+    assert breaker.allow()
+
+    # the trial never records an outcome, another one is let through later
+    clock.return_value += 29
+    assert not breaker.allow()
+    clock.return_value += 1
+    assert breaker.allow()
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+
+
+@pytest.mark.asyncio
+async def test_execute_opens_and_closes_breaker(breaker, clock):
+    for _ in range(2):
+        with pytest.raises(ConnectionError):
+            await execute(fail)
+    assert breaker.state == CircuitBreaker.OPEN
+
+    called = mock.AsyncMock()
+    with pytest.raises(CircuitOpenError):
+        await execute(called)
+    called.assert_not_called()
+
+    clock.return_value += 30
+    assert await execute(succeed) == 'PONG'
+    assert breaker.state == CircuitBreaker.CLOSED
+
+
+@pytest.mark.asyncio
+async def test_execute_error_reply_closes_half_open_breaker(breaker, clock):
+    async def error_reply(redis):
+        raise ResponseError('WRONGTYPE')
+
+    for _ in range(2):
+        with pytest.raises(ConnectionError):
+            await execute(fail)
+    clock.return_value += 30
+
+    with pytest.raises(ResponseError):
+        await execute(error_reply)
+    assert breaker.state == CircuitBreaker.CLOSED
+
+
+@pytest.mark.asyncio
+async def test_execute_cancelled_trial(breaker, clock):
+    async def hang(redis):
+        await asyncio.sleep(10)
+
+    for _ in range(2):
+        with pytest.raises(ConnectionError):
+            await execute(fail)
+    clock.return_value += 30
+
+    with pytest.raises(asyncio.TimeoutError):
+        await asyncio.wait_for(execute(hang), 0.01)
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+
+    clock.return_value += 30
+    assert await execute(succeed) == 'PONG'
+    assert breaker.state == CircuitBreaker.CLOSED
+
+
+@pytest.mark.asyncio
+async def test_rate_limit_local_fallback_without_redis():
+    backend = RedisRateLimitBackend(failure_mode="local", fallback=MemoryRateLimitBackend())
+    with mock.patch('app.common.rate_limiting.execute', side_effect=ConnectionError('Redis is down')):
+        results = [await backend.hit('rate_limit:test', 2, 60) for _ in range(3)]
+    assert [result.allowed for result in results] == [True, True, False]
+
+
+@pytest.mark.asyncio
+async def test_rate_limit_fail_open_without_redis():
+    backend = RedisRateLimitBackend(failure_mode="open")
+    with mock.patch('app.common.rate_limiting.execute', side_effect=CircuitOpenError('Redis circuit breaker is open')):
+        results = [await backend.hit('rate_limit:test', 2, 60) for _ in range(3)]
+    assert all(result.allowed for result in results)
@@ -0,0 +1,75 @@
+import importlib
+import pytest
+from unittest import mock
+from redis.exceptions import ConnectionError
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.common import db
+from app.common.db import RoutingSession, async_engine, use_primary, use_replica
+from app.middlewares import ReplicaRoutingMiddleware
+
+# `app.middlewares` is also the name of the middleware list exported by `app`
+middlewares = importlib.import_module('app.middlewares')
+
+
+@pytest.fixture
+def replicas():
+    replicas = [mock.Mock(name='replica1'), mock.Mock(name='replica2')]
+    with mock.patch.object(db, 'replica_engines', replicas), mock.patch.object(middlewares, 'replica_engines', replicas):
+        yield replicas
+
+
+def test_get_bind_pins_one_replica_per_session(replicas):
+    binds = set()
+    for _ in range(10):
+        session = RoutingSession(info={"use_replica": True})
+        session_binds = {session.get_bind() for _ in range(10)}
+        assert len(session_binds) == 1
+        binds |= session_binds
+    assert binds <= {replica.sync_engine for replica in replicas}
+
+
+def test_get_bind_uses_primary(replicas):
+    assert RoutingSession(info={"use_replica": False}).get_bind() is async_engine.sync_engine
+
+    # once it has written, a session reads its own writes
+    session = RoutingSession(info={"use_replica": True})
+    session.info["wrote"] = True
+    assert session.get_bind() is async_engine.sync_engine
+
+    session = AsyncSession(sync_session_class=RoutingSession, info={"use_replica": True})
+    with use_primary(session):
+        assert session.sync_session.get_bind() is async_engine.sync_engine
+    assert session.sync_session.get_bind() is not async_engine.sync_engine
+
+
+async def route(method: str, execute: mock.AsyncMock, status: int = 200) -> bool:
+    routed = {}
+
+    async def app(scope, receive, send):
+        routed['use_replica'] = use_replica.get()
+        await send({'type': 'http.response.start', 'status': status, 'headers': []})
+
+    scope = {'type': 'http', 'method': method, 'headers': [(b'authorization', b'Bearer token')], 'client': ('127.0.0.1', 1)}
+    with mock.patch.object(middlewares, 'execute', execute):
+        await ReplicaRoutingMiddleware(app)(scope, mock.AsyncMock(), mock.AsyncMock())
+    return routed['use_replica']
+
+
+@pytest.mark.asyncio
+async def test_reads_use_replica_unless_pinned(replicas):
+    assert await route('GET', mock.AsyncMock(return_value=0)) is True
+    assert await route('HEAD', mock.AsyncMock(return_value=0)) is True
+    assert await route('GET', mock.AsyncMock(return_value=1)) is False
+    # without Redis the pin can't be checked, so reads stay on the primary
+    assert await route('GET', mock.AsyncMock(side_effect=ConnectionError('Redis is down'))) is False
+
+
+@pytest.mark.asyncio
+async def test_successful_writes_pin_the_client(replicas):
+    execute = mock.AsyncMock()
+    assert await route('POST', execute) is False
+    execute.assert_awaited_once()
+
+    execute = mock.AsyncMock()
+    assert await route('POST', execute, status=422) is False
+    execute.assert_not_awaited()
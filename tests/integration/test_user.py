@@ -1,12 +1,22 @@
+import asyncio
 import os
 import pytest
-from sqlalchemy import func, insert, select
+from sqlalchemy import func, insert, select, text, update
 from sqlalchemy.orm import selectinload
 from config import settings
 from unittest import mock
+from redis.exceptions import ConnectionError
 from app.common.security import encrypt
-from app.modules.core.models.user import User, UserRole, Role
+from app.modules.core.models.user import User, UserRole, Role, UserSearch
 from app.common.security import get_password_hash
+from app.modules.core.services.principal_cache import principal_cache
+from app.modules.core.services import auth_version as auth_version_service
+from app.modules.core.services.auth_version import get_auth_version, invalidate_auth_version
+from app.modules.core.services.auth_service import AuthService
+from app.modules.core.repositories.role_repository import RoleRepository
+from app.modules.core.repositories.user_repository import UserRepository
+from app.modules.core.integrity_validators.user_integrity_validator import UserIntegrityValidator
+from app.modules.core.schemas.user_schemas import UserCreate, UserFilters
 from tests.conftest import (
     app,
     test_client,
@@ -15,6 +25,7 @@ from tests.conftest import (
     DEFAULT_COUNTRIES,
     setup_db,
     get_access_token,
+    count_queries,
 )
 
 DEFAULT_USER = [
@@ -201,3 +212,463 @@ async def test_post_user(app, test_client, current_transaction, setup_db):
     assert user.email == data['email']
     assert user.country_id == data['country_id']
     assert len(user.roles) == 2
+
+
+@pytest.mark.asyncio
+async def test_principal_cache(app, test_client, current_transaction, setup_db):
+    user = (
+        await current_transaction.execute(
+            select(User)
+                .options(selectinload(User.roles))
+                .where(User.id == DEFAULT_USER[0]['id'])
+        )
+    ).unique().one()[0]
+    role_id = user.roles[0].id
+    token = get_access_token(user)
+    headers = {'Authorization': f'Bearer {token}'}
+
+    # the first authenticated request populates the cache
+    response = await test_client.get(app.url_path_for('user.get_user', user_id=user.id), headers=headers)
+    assert response.status_code == 200
+
+    principal = await principal_cache.get(user.id)
+    assert principal is not None
+    assert principal.role_ids == [role_id]
+    assert set(principal.permissions) == {'base', 'admin'}
+
+    # updating the user invalidates it
+    response = await test_client.put(
+        app.url_path_for('user.put_user', user_id=user.id),
+        headers=headers,
+        data={'name': 'Test2', 'surname': 'User2', 'country_id': 2, 'role_ids': str(role_id)}
+    )
+    assert response.status_code == 200
+    assert principal_cache.local.get(str(user.id)) is None
+
+
+@pytest.mark.asyncio
+async def test_claims_mode(app, test_client, current_transaction, setup_db):
+    user = (
+        await current_transaction.execute(
+            select(User)
+                .options(selectinload(User.roles).selectinload(Role.permissions), selectinload(User.country))
+                .where(User.id == DEFAULT_USER[0]['id'])
+        )
+    ).unique().one()[0]
+    role_id = user.roles[0].id
+
+    with mock.patch.object(settings, 'JWT_CLAIMS_MODE', True):
+        auth_version = await get_auth_version(current_transaction, user.id)
+        token = AuthService.create_access_token(user, auth_version)
+        headers = {'Authorization': f'Bearer {token}'}
+
+        response = await test_client.get(app.url_path_for('user.get_user', user_id=user.id), headers=headers)
+        assert response.status_code == 200
+
+        # updating the user bumps the version so the old claims are no longer trusted
+        response = await test_client.put(
+            app.url_path_for('user.put_user', user_id=user.id),
+            headers=headers,
+            data={'name': 'Test2', 'surname': 'User2', 'country_id': 2, 'role_ids': str(role_id)}
+        )
+        assert response.status_code == 200
+        assert await get_auth_version(current_transaction, user.id) == auth_version + 1
+
+
+@pytest.mark.asyncio
+async def test_claims_mode_bump_without_redis(app, test_client, current_transaction, setup_db):
+    user = (
+        await current_transaction.execute(
+            select(User)
+                .options(selectinload(User.roles).selectinload(Role.permissions), selectinload(User.country))
+                .where(User.id == DEFAULT_USER[0]['id'])
+        )
+    ).unique().one()[0]
+    role_id = user.roles[0].id
+
+    with mock.patch.object(settings, 'JWT_CLAIMS_MODE', True):
+        auth_version = await get_auth_version(current_transaction, user.id)
+        headers = {'Authorization': f'Bearer {AuthService.create_access_token(user, auth_version)}'}
+
+        with mock.patch('app.modules.core.services.auth_version.execute', side_effect=ConnectionError('Redis is down')):
+            response = await test_client.put(
+                app.url_path_for('user.put_user', user_id=user.id),
+                headers=headers,
+                data={'name': 'Test2', 'surname': 'User2', 'country_id': 2, 'role_ids': str(role_id)}
+            )
+            assert response.status_code == 200
+            # the bump was committed with the update and is read back from the database
+            assert await get_auth_version(current_transaction, user.id) == auth_version + 1
+
+
+@pytest.mark.asyncio
+async def test_claims_mode_stale_version_not_cached_after_bump(app, test_client, current_transaction, setup_db):
+    user_id = DEFAULT_USER[0]['id']
+
+    with mock.patch.object(settings, 'JWT_CLAIMS_MODE', True):
+        auth_version = await get_auth_version(current_transaction, user_id)
+        await current_transaction.execute(
+            update(User).where(User.id == user_id).values(auth_version=User.auth_version + 1)
+        )
+        await invalidate_auth_version(current_transaction, user_id)
+
+        # a read that loaded the version before the bump committed caches it late
+        await auth_version_service._cache(user_id, auth_version)
+        assert await get_auth_version(current_transaction, user_id) == auth_version + 1
+
+
+@pytest.mark.asyncio
+async def test_claims_mode_missing_cached_version(app, test_client, current_transaction, setup_db):
+    user_id = DEFAULT_USER[0]['id']
+
+    with mock.patch.object(settings, 'JWT_CLAIMS_MODE', True):
+        auth_version = await get_auth_version(current_transaction, user_id)
+        await current_transaction.execute(
+            update(User).where(User.id == user_id).values(auth_version=User.auth_version + 1)
+        )
+
+        # as after a Redis flush or eviction: nothing is cached, so old tokens must not become valid again
+        with mock.patch('app.modules.core.services.auth_version.execute', new=mock.AsyncMock(return_value=None)):
+            assert await get_auth_version(current_transaction, user_id) == auth_version + 1
+
+
+@pytest.mark.asyncio
+async def test_get_users_cursor_pagination(app, test_client, current_transaction, setup_db):
+    await current_transaction.execute(insert(User).values([
+        {**{k: v for k, v in DEFAULT_USER[0].items() if k != 'id'}, 'username': f'paged{i}', 'email': f'paged{i}@test.com'}
+        for i in range(4)
+    ]))
+    user = (
+        await current_transaction.execute(
+            select(User)
+                .options(selectinload(User.roles))
+                .where(User.id == DEFAULT_USER[0]['id'])
+        )
+    ).unique().one()[0]
+    headers = {'Authorization': f'Bearer {get_access_token(user)}'}
+
+    # walk forward through all the pages, two users at a time
+    usernames = []
+    url = app.url_path_for('user.get_users') + '?pagination=cursor&per_page=2'
+    while url:
+        response = await test_client.get(url, headers=headers)
+        assert response.status_code == 200
+        result = response.json()['result']
+        assert result['count'] == 5
+        usernames += [item['username'] for item in result['items']]
+        url = result['next_page']
+
+    assert usernames == ['test', 'paged0', 'paged1', 'paged2', 'paged3']
+
+    # and back from the last page
+    response = await test_client.get(result['previous_page'], headers=headers)
+    assert [item['username'] for item in response.json()['result']['items']] == ['paged1', 'paged2']
+
+    response = await test_client.get(app.url_path_for('user.get_users') + '?cursor=invalid', headers=headers)
+    assert response.status_code == 400
+
+
+@pytest.mark.asyncio
+async def test_get_users_count_strategies(app, test_client, current_transaction, setup_db):
+    await current_transaction.execute(insert(User).values([
+        {**{k: v for k, v in DEFAULT_USER[0].items() if k != 'id'}, 'username': f'counted{i}', 'email': f'counted{i}@test.com'}
+        for i in range(2)
+    ]))
+    user = (
+        await current_transaction.execute(
+            select(User)
+                .options(selectinload(User.roles))
+                .where(User.id == DEFAULT_USER[0]['id'])
+        )
+    ).unique().one()[0]
+    headers = {'Authorization': f'Bearer {get_access_token(user)}'}
+    url = app.url_path_for('user.get_users')
+
+    response = await test_client.get(url + '?count=none&per_page=2', headers=headers)
+    result = response.json()['result']
+    assert result['count'] is None
+    assert len(result['items']) == 2
+    assert result['next_page'] is not None
+
+    response = await test_client.get(url + '?count=exact&per_page=2&page=2', headers=headers)
+    result = response.json()['result']
+    assert result['count'] == 3
+    assert len(result['items']) == 1
+    assert result['next_page'] is None
+
+    response = await test_client.get(url + '?count=estimated&username=counted', headers=headers)
+    assert response.status_code == 200
+    assert isinstance(response.json()['result']['count'], int)
+
+
+@pytest.mark.asyncio
+async def test_get_users_filtered_by_collection_pages_are_full(app, test_client, current_transaction, setup_db):
+    # the default user has both roles, so joining roles yields two rows for it
+    await current_transaction.execute(insert(UserRole).values({'user_id': DEFAULT_USER[0]['id'], 'role_id': 1}))
+    await current_transaction.execute(insert(User).values([
+        {**{k: v for k, v in DEFAULT_USER[0].items() if k != 'id'}, 'username': f'joined{i}', 'email': f'joined{i}@test.com'}
+        for i in range(2)
+    ]))
+    user = (
+        await current_transaction.execute(
+            select(User)
+                .options(selectinload(User.roles))
+                .where(User.id == DEFAULT_USER[0]['id'])
+        )
+    ).unique().one()[0]
+    headers = {'Authorization': f'Bearer {get_access_token(user)}'}
+    joined_ids = (await current_transaction.execute(select(User.id).where(User.username.like('joined%')))).scalars().all()
+    await current_transaction.execute(insert(UserRole).values([{'user_id': id, 'role_id': 1} for id in joined_ids]))
+
+    response = await test_client.get(app.url_path_for('user.get_users') + '?roles__name=&per_page=2', headers=headers)
+    result = response.json()['result']
+    assert result['count'] == 3
+    assert [item['username'] for item in result['items']] == ['test', 'joined0']
+    assert result['next_page'] is not None
+
+
+@pytest.mark.asyncio
+async def test_get_users_query_count(app, test_client, current_transaction, async_engine, setup_db):
+    await current_transaction.execute(insert(User).values([
+        {**{k: v for k, v in DEFAULT_USER[0].items() if k != 'id'}, 'username': f'listed{i}', 'email': f'listed{i}@test.com'}
+        for i in range(5)
+    ]))
+    listed_ids = (await current_transaction.execute(select(User.id).where(User.username.like('listed%')))).scalars().all()
+    await current_transaction.execute(insert(UserRole).values(
+        [{'user_id': id, 'role_id': 1} for id in listed_ids] + [{'user_id': id, 'role_id': 2} for id in listed_ids]
+    ))
+    user = (
+        await current_transaction.execute(
+            select(User)
+                .options(selectinload(User.roles))
+                .where(User.id == DEFAULT_USER[0]['id'])
+        )
+    ).unique().one()[0]
+    headers = {'Authorization': f'Bearer {get_access_token(user)}'}
+    url = app.url_path_for('user.get_users')
+
+    # warm up the principal cache so only the listing itself is counted
+    await test_client.get(url + '?per_page=1', headers=headers)
+
+    for per_page in (1, 6):
+        # the app shares this session, start from an empty identity map
+        current_transaction.expunge_all()
+        with count_queries(async_engine) as statements:
+            response = await test_client.get(url + f'?per_page={per_page}', headers=headers)
+        assert response.status_code == 200
+        assert len(response.json()['result']['items']) == per_page
+        # count, page of ids, users with their country, roles of the whole page
+        assert len(statements) == 4
+
+
+@pytest.mark.asyncio
+async def test_role_lookups_are_batched(current_transaction, async_engine, setup_db):
+    repository = RoleRepository(current_transaction)
+    current_transaction.expunge_all()
+
+    with count_queries(async_engine) as statements:
+        roles = await asyncio.gather(*[repository.get_first_by_field('id', id) for id in (1, 2, 999)])
+    assert [role.id if role else None for role in roles] == [1, 2, None]
+    assert len(statements) == 1
+
+    # memoized for the rest of the session, only the unknown id is queried again
+    with count_queries(async_engine) as statements:
+        roles = await repository.get_by_ids([2, 1, 999])
+    assert [role.id for role in roles] == [2, 1]
+    assert len(statements) == 1
+
+
+@pytest.mark.asyncio
+async def test_create_validation_is_a_single_query(current_transaction, async_engine, setup_db):
+    validator = UserIntegrityValidator(UserRepository(current_transaction))
+    user_data = UserCreate(
+        username='test',
+        password='testpassword',
+        password_confirmation='testpassword',
+        name='Test',
+        surname='User',
+        email='test@test.com',
+        country_id=999,
+        role_ids=[1, 999]
+    )
+
+    with count_queries(async_engine) as statements:
+        validation_errors = await validator.validate_data_create(user_data)
+
+    assert len(statements) == 1
+    assert [(error.loc[-1], error.type) for error in validation_errors] == [
+        ('country_id', 'db_error.not_found'),
+        ('role_id', 'db_error.not_found'),
+        ('email', 'db_error.duplicate'),
+        ('username', 'db_error.duplicate'),
+    ]
+
+
+@pytest.mark.asyncio
+async def test_bulk_operations(current_transaction, setup_db):
+    repository = UserRepository(current_transaction)
+
+    rows = await repository.bulk_insert(
+        [{'username': f'bulk{i}', 'email': f'bulk{i}@test.com', 'active': False} for i in range(3)],
+        returning=['id', 'username']
+    )
+    assert [row.username for row in rows] == ['bulk0', 'bulk1', 'bulk2']
+
+    await repository.bulk_update([{'id': row.id, 'name': f'Bulk {row.id}'} for row in rows])
+    names = (await current_transaction.execute(select(User.name).where(User.id.in_([row.id for row in rows])))).scalars().all()
+    assert sorted(names) == sorted(f'Bulk {row.id}' for row in rows)
+
+    upserted = await repository.upsert(
+        [{'username': 'bulk0', 'email': 'changed@test.com'}, {'username': 'bulk3', 'email': 'bulk3@test.com'}],
+        index_elements=['username'], update_fields=['email'], returning=['username', 'email']
+    )
+    assert sorted(upserted) == [('bulk0', 'changed@test.com'), ('bulk3', 'bulk3@test.com')]
+
+    assert await repository.bulk_delete(User.username.like('bulk%')) == 4
+
+
+@pytest.mark.asyncio
+async def test_search_filters_can_use_trigram_indexes(current_transaction, setup_db):
+    # tiny tables are always scanned sequentially, take that option away
+    await current_transaction.execute(text("SET LOCAL enable_seqscan = off"))
+    connection = await current_transaction.connection()
+
+    for filters, index in (
+        (UserFilters(full_name='jose gar'), 'ix_users_full_name_search'),
+        (UserFilters(email='@test.c'), 'ix_users_email_search'),
+        (UserFilters(username='tes'), 'ix_users_username_search'),
+    ):
+        statement = filters.apply_filters().compile(dialect=connection.dialect, compile_kwargs={'literal_binds': True})
+        plan = '\n'.join((await connection.exec_driver_sql(f"EXPLAIN {statement}")).scalars())
+        assert index in plan
+
+
+@pytest.mark.asyncio
+async def test_to_many_filters_use_exists(current_transaction, setup_db):
+    query = UserFilters(roles__id=2, roles__name='adm', country__name='country1').apply_filters()
+    sql = str(query.compile())
+    # one join for the many-to-one country, the roles filters are semi-joins
+    assert sql.count('JOIN') == 1
+    assert sql.count('EXISTS') == 2
+
+    user_ids = (await current_transaction.execute(query.with_only_columns(User.id))).scalars().all()
+    assert user_ids == [DEFAULT_USER[0]['id']]
+
+
+def test_filter_plan_is_compiled_once():
+    assert UserFilters().get_filter_plan() is UserFilters(email='a').get_filter_plan()
+
+    # same filters with different values: same statement cache key, so the SQL is compiled once
+    first = UserFilters(full_name='a', country__name='b', roles__name='c').apply_filters()
+    second = UserFilters(full_name='x', country__name='y', roles__name='z').apply_filters()
+    assert first._generate_cache_key().key == second._generate_cache_key().key
+
+
+@pytest.mark.asyncio
+async def test_get_users_sparse_fields(app, test_client, current_transaction, setup_db):
+    user = (
+        await current_transaction.execute(
+            select(User)
+                .options(selectinload(User.roles))
+                .where(User.id == DEFAULT_USER[0]['id'])
+        )
+    ).unique().one()[0]
+    headers = {'Authorization': f'Bearer {get_access_token(user)}'}
+    expected = {'id': DEFAULT_USER[0]['id'], 'username': 'test', 'email': 'test@test.com'}
+
+    response = await test_client.get(app.url_path_for('user.get_users') + '?fields=username,email', headers=headers)
+    assert response.status_code == 200
+    assert response.json()['result']['items'] == [expected]
+
+    url = app.url_path_for('user.get_user', user_id=DEFAULT_USER[0]['id'])
+    response = await test_client.get(url + '?fields=username,email', headers=headers)
+    assert response.json()['result'] == expected
+
+    response = await test_client.get(url + '?fields=username,password_hash', headers=headers)
+    assert response.status_code == 400
+
+
+@pytest.mark.asyncio
+async def test_get_users_sorted(app, test_client, current_transaction, setup_db):
+    await current_transaction.execute(insert(User).values([
+        {**{k: v for k, v in DEFAULT_USER[0].items() if k != 'id'}, 'username': username, 'email': f'{username}@test.com'}
+        for username in ('bravo', 'alpha', 'charlie')
+    ]))
+    user = (
+        await current_transaction.execute(
+            select(User)
+                .options(selectinload(User.roles))
+                .where(User.id == DEFAULT_USER[0]['id'])
+        )
+    ).unique().one()[0]
+    headers = {'Authorization': f'Bearer {get_access_token(user)}'}
+    url = app.url_path_for('user.get_users')
+
+    response = await test_client.get(url + '?sort=-username&per_page=2&page=2', headers=headers)
+    assert [item['username'] for item in response.json()['result']['items']] == ['bravo', 'alpha']
+
+    usernames = []
+    next_page = url + '?sort=username&pagination=cursor&per_page=3'
+    while next_page:
+        result = (await test_client.get(next_page, headers=headers)).json()['result']
+        usernames += [item['username'] for item in result['items']]
+        next_page = result['next_page']
+    assert usernames == ['alpha', 'bravo', 'charlie', 'test']
+
+    response = await test_client.get(url + '?sort=password_hash', headers=headers)
+    assert response.status_code == 400
+
+
+@pytest.mark.asyncio
+async def test_user_search_read_model(current_transaction, setup_db):
+    user_id = DEFAULT_USER[0]['id']
+    search = (await current_transaction.execute(select(UserSearch).where(UserSearch.user_id == user_id))).scalar_one()
+    assert (search.full_name, search.country_name, search.role_ids, search.role_names) == ('test user', 'country1', [2], 'admin')
+
+    # kept up to date by the triggers
+    await current_transaction.execute(update(User).where(User.id == user_id).values(name='José'))
+    await current_transaction.execute(insert(UserRole).values(user_id=user_id, role_id=1))
+    await current_transaction.refresh(search)
+    assert (search.full_name, search.role_ids, search.role_names) == ('jose user', [1, 2], 'user\nadmin')
+
+    # and gives the same results as the regular filters
+    filters = UserFilters(full_name='JOSE us', roles__id=1, roles__name='adm', country__name='COUNTRY')
+    expected = (await current_transaction.execute(filters.apply_filters().with_only_columns(User.id))).scalars().all()
+    with mock.patch.object(settings, 'USER_SEARCH_READ_MODEL_ENABLED', True), \
+         mock.patch.dict('app.common.filtering._filter_plans', clear=True):
+        query = filters.apply_filters()
+        assert 'user_search' in str(query.compile())
+        found = (await current_transaction.execute(query.with_only_columns(User.id))).scalars().all()
+    assert found == expected == [user_id]
+
+
+@pytest.mark.asyncio
+async def test_suggest(app, test_client, current_transaction, setup_db):
+    await current_transaction.execute(insert(User).values([
+        {**{k: v for k, v in DEFAULT_USER[0].items() if k != 'id'}, 'username': username, 'email': f'{username}@test.com',
+         'name': name, 'surname': 'Suggested'}
+        for username, name in (('suggest1', 'Ángela'), ('suggest2', 'Andrés'), ('anonymous', 'Zoe'))
+    ]))
+    user = (
+        await current_transaction.execute(
+            select(User)
+                .options(selectinload(User.roles))
+                .where(User.id == DEFAULT_USER[0]['id'])
+        )
+    ).unique().one()[0]
+    headers = {'Authorization': f'Bearer {get_access_token(user)}'}
+
+    # prefix of the full name (accents and case ignored) or of the username, alphabetically
+    response = await test_client.get(app.url_path_for('user.suggest_users') + '?q=AN', headers=headers)
+    assert response.status_code == 200
+    assert [item['name'] for item in response.json()['result']] == ['Andrés Suggested', 'Ángela Suggested', 'Zoe Suggested']
+    assert set(response.json()['result'][0]) == {'id', 'name'}
+
+    response = await test_client.get(app.url_path_for('user.suggest_users') + '?q=an&limit=1', headers=headers)
+    assert len(response.json()['result']) == 1
+
+    response = await test_client.get(app.url_path_for('user.suggest_users') + '?q=an&limit=1000', headers=headers)
+    assert response.status_code == 422
+
+    response = await test_client.get(app.url_path_for('params.suggest_countries') + '?q=country2')
+    assert response.json()['result'] == [{'id': 2, 'name': DEFAULT_COUNTRIES[1]['name']}]